@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+Asynchronous fetch engine used by the scrapers. Keeps a bounded number of
+requests in flight, caps the concurrency per host and replaces the blocking
+time.sleep() politeness pause by a token-bucket rate limiter per host.
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+
+
+#%%
+""" Object definitions """
+
+class TokenBucket():
+    """Asynchronous token-bucket rate limiter
+
+    Attributes:
+        rate (float): Tokens added per second, None disables the limiter
+        capacity (int): Maximum amount of tokens (burst size)
+
+    """
+    def __init__(self, rate, capacity = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """Waits until a token is available and consumes it"""
+        if not self.rate:
+            return
+        async with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class AsyncFetcher():
+    """Fetches many urls concurrently with bounded global and per-host concurrency
+
+    Blocking requests calls are executed on a private thread pool sized to the
+    global concurrency, so the event loop only schedules and throttles them.
+
+    Attributes:
+        concurrency (int): Maximum amount of requests in flight overall
+        per_host (int): Maximum amount of requests in flight per host
+        rate (float): Maximum requests per second per host, None for no limit
+        burst (int): Amount of requests per host that may be sent back to back
+        get: Callable used to perform the request, defaults to requests.get
+        timeout (float): Timeout in seconds passed to every request
+        window (int): Maximum amount of urls scheduled at once, including the ones waiting
+                      for their host, defaults to 10 times the concurrency
+
+    """
+    def __init__(self, concurrency = 10, per_host = 2, rate = None, burst = 1,
+                 get = None, timeout = 30, window = None):
+        self.concurrency = concurrency
+        self.window = window if window is not None else 10 * concurrency
+        self.per_host = per_host
+        self.rate = rate
+        self.burst = burst
+        self.get = get if get is not None else requests.get
+        self.timeout = timeout
+        self.hosts = {}
+
+    def _host_limits(self, url):
+        """Returns the (semaphore, token bucket) pair of the host of `url`"""
+        host = urlsplit(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = (asyncio.Semaphore(self.per_host),
+                                TokenBucket(self.rate, self.burst))
+        return self.hosts[host]
+
+    async def fetch(self, url, executor, limit):
+        """Fetches one url respecting all concurrency and rate limits
+        Args:
+            url: url to be requested
+            executor: thread pool executing the blocking request
+            limit: global semaphore
+
+        Returns:
+            tuple of url and response (or the exception raised while fetching)
+        """
+        semaphore, bucket = self._host_limits(url)
+        #Wait for the host first, a global slot is only taken once the request can be sent,
+        #so a throttled host never holds up the requests to the other hosts
+        async with semaphore:
+            await bucket.acquire()
+            async with limit:
+                loop = asyncio.get_running_loop()
+                try:
+                    resp = await loop.run_in_executor(executor, lambda: self.get(url, timeout = self.timeout))
+                except requests.exceptions.RequestException as e:
+                    resp = e
+        return(url, resp)
+
+    async def fetch_all(self, urls, callback = None):
+        """Fetches all urls and returns the results in the order of `urls`
+        Args:
+            urls: iterable of urls
+            callback: optional function called with (url, response) as soon as a request completes
+
+        Returns:
+            list of (url, response) tuples
+        """
+        self.hosts = {}
+        limit = asyncio.Semaphore(self.concurrency)
+        results = {}
+
+        async def run_one(i, url):
+            result = await self.fetch(url, executor, limit)
+            if callback is not None:
+                callback(*result)
+            results[i] = result
+
+        with ThreadPoolExecutor(max_workers = self.concurrency) as executor:
+            #Only `window` urls are scheduled at once instead of one task per url up front
+            pending = set()
+            for i, url in enumerate(urls):
+                if len(pending) >= self.window:
+                    done, pending = await asyncio.wait(pending, return_when = asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()
+                pending.add(asyncio.ensure_future(run_one(i, url)))
+            if pending:
+                done, _ = await asyncio.wait(pending)
+                for task in done:
+                    task.result()
+        return([results[i] for i in range(len(results))])
+
+    def run(self, urls, callback = None):
+        """Blocking wrapper around fetch_all, starts and closes its own event loop"""
+        return(asyncio.run(self.fetch_all(urls, callback)))
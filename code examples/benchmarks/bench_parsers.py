@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmark of the parser backends of html_parsers on recorded pages:
+review pages, the list of mathematicians and library search results. Every
+backend runs the same extraction as the scrapers, the results are checked
+against lxml and the fastest backend per page type is reported.
+
+Usage:
+    python bench_parsers.py --repeat 20
+    python bench_parsers.py --pages ../reviews_spill --json parsers.json
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from html_parsers import BACKENDS, get_extractor
+from review_parser import REVIEW_SELECTORS, parse_reviews
+from stand_in_server import StandInSite
+
+
+#%%
+""" Function definitions """
+
+def available_backends():
+    """Returns the backends that can be loaded, selectolax is optional"""
+    backends = []
+    for backend in BACKENDS:
+        try:
+            get_extractor(REVIEW_SELECTORS, backend)
+            backends.append(backend)
+        except ImportError as e:
+            print("Skipping " + backend + ": " + str(e))
+    return(backends)
+
+
+def extract_texts(css, limit = None):
+    """Returns an extraction function reading the texts of the elements matching `css`, like
+    select_texts of example_mathematicians with the utf-8 the stand-in server declares"""
+    def extract(body, backend):
+        extractor = get_extractor({'items': css}, backend)
+        nodes = extractor.select('items', extractor.parse(body, 'utf-8'))
+        return([extractor.text(node) for node in nodes[:limit]])
+    return(extract)
+
+
+def extract_reviews(body, backend):
+    return(parse_reviews('url', body, backend = backend)[0])
+
+
+def recorded_pages(directory):
+    """Reads the .html and .html.gz pages of a directory, e.g. the spill_dir of the ReviewScraper"""
+    pages = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith('.html.gz'):
+            with gzip.open(path, 'rb') as f:
+                pages.append(f.read())
+        elif name.endswith(('.html', '.htm')):
+            with open(path, 'rb') as f:
+                pages.append(f.read())
+    return(pages)
+
+
+def page_types(directory = None):
+    """Returns the page types to measure as a dictionary of name to (pages, extraction function)"""
+    site = StandInSite()
+    reviews = [site.profile_page(beer % 50, beer, 25 * k).encode('utf-8') for beer in range(10) for k in range(2)]
+    types = {'reviews': (reviews, extract_reviews),
+             'names': ([site.mathmen.encode('utf-8')], extract_texts('li')),
+             'hits': ([site.tpl_page("name {}".format(k)).encode('utf-8') for k in range(20)],
+                      extract_texts('h3.item-count', limit = 1))}
+    if directory is not None:
+        types['recorded_reviews'] = (recorded_pages(directory), extract_reviews)
+    return(types)
+
+
+def measure(pages, extract, backend, repeat):
+    """Runs the extraction of every page `repeat` times
+    Returns:
+        tuple of the milliseconds per page (best of the repeats) and the results of the last run
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        results = [extract(body, backend) for body in pages]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return(best / max(len(pages), 1) * 1000, results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Micro-benchmark of the HTML parser backends")
+    parser.add_argument('--repeat', type = int, default = 10, help = "runs per backend, the best one counts")
+    parser.add_argument('--pages', help = "directory with recorded review pages (.html or .html.gz) to add")
+    parser.add_argument('--json', help = "write the results to this file")
+    args = parser.parse_args()
+
+    backends = available_backends()
+    results = []
+    for page_type, (pages, extract) in page_types(args.pages).items():
+        if not pages:
+            continue
+        reference = None
+        for backend in backends:
+            ms, output = measure(pages, extract, backend, args.repeat)
+            #lxml is the reference, every backend has to extract exactly the same
+            reference = output if reference is None else reference
+            results.append({'pages': page_type, 'backend': backend, 'n': len(pages), 'ms_per_page': round(ms, 3),
+                            'identical': output == reference})
+
+    print("{:<18}{:<12}{:>6}{:>13}{:>10}{:>11}".format('pages', 'backend', 'n', 'ms/page', 'speedup', 'identical'))
+    for page_type in dict.fromkeys(row['pages'] for row in results):
+        rows = [row for row in results if row['pages'] == page_type]
+        for row in rows:
+            print("{pages:<18}{backend:<12}{n:>6}{ms_per_page:>13}".format(**row) +
+                  "{:>10}".format(str(round(rows[0]['ms_per_page'] / max(row['ms_per_page'], 1e-9), 2)) + "x") +
+                  "{!s:>11}".format(row['identical']))
+        fastest = min((row for row in rows if row['identical']), key = lambda row: row['ms_per_page'])
+        print("{:<18}fastest: {}".format('', fastest['backend']))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent = 2)
+    return(0 if all(row['identical'] for row in results) else 1)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
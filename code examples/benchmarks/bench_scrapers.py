@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Offline benchmark of the scrapers against the local stand-in server.
+Every case runs in its own subprocess so the peak RSS belongs to that case
+only, and reports throughput, p50/p99 request latency and peak memory.
+
+Usage:
+    python bench_scrapers.py --latency 0.02 --error-rate 0.01 --json results.json
+    python bench_scrapers.py --compare results.json --tolerance 0.2
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import argparse
+import contextlib
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+from stand_in_server import StandInServer, StandInSite
+
+
+#%%
+""" Settings """
+CASES = ['reviews', 'reviews_async', 'reviews_pipeline', 'urls', 'mathematicians', 'mathematicians_concurrent']
+
+#Direction in which every metric gets worse, used when comparing against a baseline
+WORSE_WHEN = {'throughput': 'lower', 'p50_ms': 'higher', 'p99_ms': 'higher', 'peak_rss_mb': 'higher'}
+
+
+#%%
+""" Function definitions """
+
+def peak_rss_mb():
+    """Returns the peak resident set size of this process in MB, None if it can not be measured"""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        #Linux reports kilobytes, macOS bytes
+        return(peak / 1024**2 if sys.platform == 'darwin' else peak / 1024)
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return(psutil.Process().memory_info().peak_wset / 1024**2)
+    except (ImportError, AttributeError):
+        return(None)
+
+
+def percentile(values, q):
+    if not values:
+        return(None)
+    values = sorted(values)
+    return(values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))])
+
+
+def search_terms(n):
+    return(["Bench Brand {} Variant {}".format(k % 37, k) for k in range(n)])
+
+
+def run_case(case, base_url, beers, names, workers):
+    """Runs one benchmark case in this process
+    Returns:
+        dictionary with the metrics of the case
+    """
+    import pandas as pd
+    import http_session
+    import example_BA
+    import example_mathematicians
+
+    session = http_session.configure(pool_maxsize = max(20, workers * 2))
+    latencies = []
+    session.hooks['response'].append(lambda resp, *args, **kwargs: latencies.append(resp.elapsed.total_seconds()))
+
+    example_BA.URLScraper.base_string = base_url + "/search/"
+    example_mathematicians.NAMES_URL = base_url + "/james/mathmen.htm"
+    example_mathematicians.HITS_URL_ROOT = base_url + "/search.jsp?Ntt={name}"
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        if case.startswith('reviews'):
+            #Review pages of `beers` beers, all pages of every beer
+            site = StandInSite()
+            links = []
+            for beer in range(beers):
+                n_pages = (site.n_reviews(beer) - 1) // 25 + 1
+                links.extend("{}/beer/profile/{}/{}/?view=beer&sort=&start={}".format(base_url, beer % 50, beer, 25 * k)
+                             for k in range(n_pages))
+            data = pd.DataFrame({'Beer_link': links, 'Beer_search': ["beer"] * len(links)})
+            scraper = example_BA.ReviewScraper(data, pause = 0, session = session)
+            if case == 'reviews':
+                scraper.scrape()
+            elif case == 'reviews_async':
+                scraper.scrape_async(concurrency = workers, per_host = workers, rate = None)
+            else:
+                scraper.scrape_pipeline(fetchers = workers)
+            scraper.compile_results()
+            items = len(scraper.output)
+        elif case == 'urls':
+            scraper = example_BA.URLScraper(workers, search_terms(beers), backend = 'http', max_workers = workers)
+            scraper.compile_results()
+            items = len(scraper.output)
+        elif case == 'mathematicians':
+            results = []
+            for name in example_mathematicians.get_names()[:names]:
+                hits = example_mathematicians.get_hits_on_name(name)
+                results.append((hits if hits is not None else -1, name))
+            items = len(results)
+        elif case == 'mathematicians_concurrent':
+            names_found = example_mathematicians.get_names()[:names]
+            items = sum(1 for _ in example_mathematicians.get_hits_on_names(names_found, workers = workers))
+        else:
+            raise ValueError("Unknown case: {}".format(case))
+    elapsed = time.perf_counter() - start
+
+    return({'case': case, 'requests': len(latencies), 'items': items, 'seconds': round(elapsed, 3),
+            'throughput': round(len(latencies) / elapsed, 2),
+            'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+            'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+            'peak_rss_mb': round(peak_rss_mb(), 1) if peak_rss_mb() is not None else None})
+
+
+def compare(results, baseline, tolerance):
+    """Lists the metrics that got worse than the baseline by more than `tolerance`
+    Returns:
+        list of strings describing the regressions
+    """
+    baseline = {row['case']: row for row in baseline}
+    regressions = []
+    for row in results:
+        old = baseline.get(row['case'])
+        if old is None:
+            continue
+        for metric, worse in WORSE_WHEN.items():
+            if row.get(metric) is None or not old.get(metric):
+                continue
+            change = (row[metric] - old[metric]) / old[metric]
+            if (worse == 'higher' and change > tolerance) or (worse == 'lower' and -change > tolerance):
+                regressions.append("{} {}: {} -> {} ({:+.0%})".format(row['case'], metric, old[metric], row[metric], change))
+    return(regressions)
+
+
+def main():
+    parser = argparse.ArgumentParser(description = "Offline benchmark of the scrapers")
+    parser.add_argument('--cases', nargs = '+', default = CASES, choices = CASES)
+    parser.add_argument('--latency', type = float, default = 0.01, help = "server latency per request in seconds")
+    parser.add_argument('--jitter', type = float, default = 0.0, help = "maximum extra random latency in seconds")
+    parser.add_argument('--error-rate', type = float, default = 0.0, help = "share of requests answered with 503")
+    parser.add_argument('--beers', type = int, default = 20, help = "amount of beers / search terms")
+    parser.add_argument('--names', type = int, default = 60, help = "amount of mathematicians to look up")
+    parser.add_argument('--workers', type = int, default = 8, help = "concurrency of the parallel cases")
+    parser.add_argument('--json', help = "write the results to this file")
+    parser.add_argument('--compare', help = "baseline results file to check for regressions")
+    parser.add_argument('--tolerance', type = float, default = 0.2, help = "allowed relative slowdown")
+    parser.add_argument('--run-case', help = argparse.SUPPRESS)
+    parser.add_argument('--base-url', help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        #Child process: run one case and report the metrics as the last line of output
+        print(json.dumps(run_case(args.run_case, args.base_url, args.beers, args.names, args.workers)))
+        return(0)
+
+    server = StandInServer(latency = args.latency, jitter = args.jitter, error_rate = args.error_rate).start()
+    results = []
+    try:
+        for case in args.cases:
+            command = [sys.executable, os.path.abspath(__file__), '--run-case', case, '--base-url', server.base_url,
+                       '--beers', str(args.beers), '--names', str(args.names), '--workers', str(args.workers)]
+            completed = subprocess.run(command, capture_output = True, text = True, cwd = os.path.dirname(HERE))
+            if completed.returncode != 0:
+                print("-----------------------------")
+                print(case + " failed:")
+                print(completed.stderr)
+                continue
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    finally:
+        server.stop()
+
+    print("{:<27}{:>9}{:>8}{:>9}{:>12}{:>9}{:>9}{:>10}".format('case', 'requests', 'items', 'seconds', 'requests/s',
+                                                           'p50 ms', 'p99 ms', 'RSS MB'))
+    for row in results:
+        print("{case:<27}{requests:>9}{items:>8}{seconds:>9}{throughput:>12}{p50_ms!s:>9}{p99_ms!s:>9}{peak_rss_mb!s:>10}".format(**row))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent = 2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nPerformance regressions:")
+            for line in regressions:
+                print("  " + line)
+            return(1)
+        print("\nNo regressions against " + args.compare)
+    return(0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
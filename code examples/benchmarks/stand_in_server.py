@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+Local stand-in for beeradvocate.com, torontopubliclibrary.ca and the list of
+mathematicians. Serves the recorded pages in fixtures/ with configurable
+latency and error injection, so the scrapers can be measured offline.
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import os
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from string import Template
+from urllib.parse import parse_qs, urlsplit
+
+
+#%%
+""" Settings """
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+REVIEWS_PER_PAGE = 25
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding = "utf-8") as f:
+        return(Template(f.read()))
+
+
+def stable_hash(text):
+    """Deterministic hash, so every run serves the same pages for the same terms"""
+    return(zlib.crc32(text.encode("utf-8")))
+
+
+#%%
+""" Object definitions """
+
+class StandInSite():
+    """Renders the fixture pages, every search term and beer maps to a deterministic page"""
+    def __init__(self):
+        self.search = load_fixture("ba_search.html")
+        self.search_result = load_fixture("ba_search_result.html")
+        self.profile = load_fixture("ba_profile.html")
+        self.pagination = load_fixture("ba_pagination.html")
+        self.review = load_fixture("ba_review.html")
+        self.tpl_search = load_fixture("tpl_search.html")
+        with open(os.path.join(FIXTURES, "mathmen.htm"), encoding = "utf-8") as f:
+            self.mathmen = f.read()
+
+    def beer_for(self, term):
+        """Returns the (brewery, beer) ids a search term resolves to"""
+        h = stable_hash(term.lower())
+        #Several search terms resolve to the same beer, as product variants do on the real site
+        return(h % 50, h % 400)
+
+    def n_reviews(self, beer):
+        return(5 + (beer * 37) % 240)
+
+    def search_page(self, term):
+        """Returns (status, location, body) for a search: no results, a redirect or a result list"""
+        kind = stable_hash(term) % 10
+        brewery, beer = self.beer_for(term)
+        if kind == 0:
+            return(200, None, self.search.substitute(query = term, results = ""))
+        if kind <= 3:
+            return(302, "/beer/profile/{}/{}/".format(brewery, beer), "")
+        results = "\n".join(self.search_result.substitute(brewery = brewery, beer = beer + k, name = "{} {}".format(term, k),
+                                                          brewery_name = "Brewery {}".format(brewery))
+                            for k in range(3))
+        return(200, None, self.search.substitute(query = term, results = results))
+
+    def profile_page(self, brewery, beer, start):
+        n_reviews = self.n_reviews(beer)
+        reviews = []
+        for k in range(start, min(start + REVIEWS_PER_PAGE, n_reviews)):
+            h = stable_hash("{}-{}".format(beer, k))
+            reviews.append(self.review.substitute(overall = "{:.2f}".format(2.5 + h % 250 / 100),
+                                                  rdev = "{:+.1f}".format((h % 400 - 200) / 10),
+                                                  look = 3 + h % 5 / 2, smell = 3 + h % 7 / 4, taste = 3 + h % 3 / 2,
+                                                  feel = 3 + h % 9 / 4, score = 3 + h % 4,
+                                                  text = "Poured from a bottle, review {} of beer {}.".format(k, beer),
+                                                  user = "user{}".format(h % 1000), date = "Mar {:02d}, 2019".format(1 + k % 28)))
+        pagination = ""
+        if n_reviews > REVIEWS_PER_PAGE:
+            last = (n_reviews - 1) // REVIEWS_PER_PAGE * REVIEWS_PER_PAGE
+            pagination = self.pagination.substitute(brewery = brewery, beer = beer, last = last,
+                                                    next = min(start + REVIEWS_PER_PAGE, last))
+        return(self.profile.substitute(name = "Beer {}".format(beer), brewery_name = "Brewery {}".format(brewery),
+                                       n_reviews = n_reviews, reviews = "\n".join(reviews), pagination = pagination))
+
+    def tpl_page(self, name):
+        h = stable_hash(name)
+        records = "".join("<li class='record'>Record {}</li>".format(k) for k in range(h % 20))
+        return(self.tpl_search.substitute(count = "{:,}".format(h % 5000), records = records))
+
+
+class StandInServer():
+    """Threaded local HTTP server for the stand-in site
+
+    Attributes:
+        latency (float): Seconds every response is delayed
+        jitter (float): Maximum extra random delay in seconds
+        error_rate (float): Share of requests answered with 503 Service Unavailable
+        port (int): Port to listen on, 0 picks a free port
+
+    """
+    def __init__(self, latency = 0.0, jitter = 0.0, error_rate = 0.0, port = 0, seed = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.site = StandInSite()
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                server.requests += 1
+                time.sleep(server.latency + server.random.uniform(0, server.jitter))
+                if server.random.random() < server.error_rate:
+                    return(self.reply(503, "<html><body>Service Unavailable</body></html>", {"Retry-After": "1"}))
+                status, location, body = server.route(self.path)
+                self.reply(status, body, {"Location": location} if location else {})
+
+            def reply(self, status, body, headers):
+                data = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "text/html; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.httpd.daemon_threads = True
+
+    @property
+    def base_url(self):
+        return("http://127.0.0.1:{}".format(self.httpd.server_address[1]))
+
+    def route(self, path):
+        """Returns (status, location, body) for a request path"""
+        url = urlsplit(path)
+        query = parse_qs(url.query)
+        parts = [part for part in url.path.split("/") if part]
+        if url.path == "/search/":
+            return(self.site.search_page(query.get("q", [""])[0]))
+        if len(parts) == 4 and parts[:2] == ["beer", "profile"]:
+            start = int(query.get("start", ["0"])[0] or 0)
+            return(200, None, self.site.profile_page(int(parts[2]), int(parts[3]), start))
+        if url.path == "/james/mathmen.htm":
+            return(200, None, self.site.mathmen)
+        if url.path == "/search.jsp":
+            return(200, None, self.site.tpl_page(query.get("Ntt", [""])[0]))
+        return(404, None, "<html><body>Not Found</body></html>")
+
+    def start(self):
+        self.thread = threading.Thread(target = self.httpd.serve_forever, daemon = True)
+        self.thread.start()
+        return(self)
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+if __name__ == '__main__':
+    server = StandInServer(port = 8765).start()
+    print("Stand-in server running at " + server.base_url)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Pool of headless Firefox drivers for the Selenium mode of the URLScraper.
+Drivers are leased per task instead of being tied to a thread, checked
+before every lease, recycled after a number of pages to cap their memory
+growth, and load pages eagerly without images, style sheets or fonts.
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import os
+import queue
+import threading
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.firefox.service import Service
+
+from scrape_metrics import METRICS
+
+
+#%%
+""" Settings """
+# Firefox preferences that skip everything the scraper does not read
+BLOCKING_PREFERENCES = {'permissions.default.image': 2,
+                        'permissions.default.stylesheet': 2,
+                        'browser.display.use_document_fonts': 0,
+                        'gfx.downloadable_fonts.enabled': False,
+                        'media.autoplay.default': 5}
+
+
+#%%
+""" Function definitions """
+
+def make_firefox(headless = True, page_load_strategy = 'eager', block_resources = True, executable_path = None):
+    """Starts a Firefox driver with the scraper preferences
+    Args:
+        headless: run without a window, so it works on a Linux box without a display
+        page_load_strategy: 'eager' returns once the DOM is ready, 'normal' waits for every resource
+        block_resources: do not load images, style sheets, web fonts and media
+        executable_path: geckodriver to use, defaults to $GECKODRIVER_PATH or the one Selenium finds itself
+
+    Returns:
+        active selenium driver
+    """
+    options = webdriver.FirefoxOptions()
+    if headless:
+        options.add_argument('-headless')
+    options.page_load_strategy = page_load_strategy
+
+    #Disable flash and webrtc, and give up on slow responses and scripts
+    options.set_preference('dom.ipc.plugins.enabled.libflashplayer.so', False)
+    options.set_preference('media.peerconnection.enabled', False)
+    options.set_preference('http.response.timeout', 5)
+    options.set_preference('dom.max_script_run_time', 5)
+    if block_resources:
+        for key, value in BLOCKING_PREFERENCES.items():
+            options.set_preference(key, value)
+
+    executable_path = executable_path or os.environ.get('GECKODRIVER_PATH')
+    service = Service(executable_path = executable_path) if executable_path else Service()
+    return(webdriver.Firefox(options = options, service = service))
+
+
+#%%
+""" Object definitions """
+
+class BrowserPool():
+    """Thread-safe pool of browser drivers leased per task
+
+    Attributes:
+        size (int): Maximum amount of drivers alive at the same time
+        factory: Function without arguments starting a new driver, defaults to make_firefox
+        max_pages (int): A driver is replaced once it loaded this many pages, None to never recycle
+
+    """
+    def __init__(self, size = 2, factory = None, max_pages = 50):
+        self.size = size
+        self.factory = factory if factory is not None else make_firefox
+        self.max_pages = max_pages
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        self.pages = {}    # Pages loaded per driver, by id of the driver
+        self.alive = 0
+
+    def healthy(self, driver):
+        """Returns True if the driver still answers"""
+        try:
+            driver.current_url
+            return(True)
+        except Exception:
+            return(False)
+
+    def discard(self, driver):
+        """Quits a driver and forgets it"""
+        with self.lock:
+            self.pages.pop(id(driver), None)
+            self.alive -= 1
+            METRICS.set('browsers_alive', self.alive)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def acquire(self):
+        """Returns an idle healthy driver, starting a new one if there is none"""
+        self.slots.acquire()
+        try:
+            while True:
+                try:
+                    driver = self.idle.get_nowait()
+                except queue.Empty:
+                    break
+                if self.healthy(driver):
+                    return(driver)
+                METRICS.inc('browsers_recycled_total', reason = 'unhealthy')
+                self.discard(driver)
+            driver = self.factory()
+            with self.lock:
+                self.pages[id(driver)] = 0
+                self.alive += 1
+                METRICS.set('browsers_alive', self.alive)
+            return(driver)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def release(self, driver, broken = False):
+        """Returns a driver to the pool, drivers that broke or reached max_pages are replaced"""
+        with self.lock:
+            pages = self.pages.get(id(driver), 0)
+        if broken or (self.max_pages is not None and pages >= self.max_pages):
+            METRICS.inc('browsers_recycled_total', reason = 'broken' if broken else 'max_pages')
+            self.discard(driver)
+        else:
+            self.idle.put(driver)
+        self.slots.release()
+
+    @contextmanager
+    def lease(self):
+        """Context manager leasing a driver for one task"""
+        driver = self.acquire()
+        broken = False
+        try:
+            yield driver
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            self.release(driver, broken)
+
+    def loaded(self, driver):
+        """Counts a page loaded by a leased driver"""
+        with self.lock:
+            if id(driver) in self.pages:
+                self.pages[id(driver)] += 1
+
+    def close(self):
+        """Quits all idle drivers"""
+        while True:
+            try:
+                driver = self.idle.get_nowait()
+            except queue.Empty:
+                return
+            self.discard(driver)
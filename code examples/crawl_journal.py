@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+Durable crawl journal. Every search term or url is recorded in SQLite as
+pending, done or failed together with its output, so a restarted run skips
+the completed work and only retries what is left.
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import json
+import sqlite3
+import threading
+import time
+
+
+#%%
+""" Settings """
+#Keys per query of todo and outputs, below the SQLite limit of 999 parameters
+CHUNK_SIZE = 500
+
+
+#%%
+""" Function definitions """
+
+def open_run(path):
+    """Returns the id of the unfinished run in the journal file `path`, or starts a new run
+
+    Journal stages named after the run keep their state when a run is restarted, also on a
+    later day, until finish_run is called. Processes sharing a WorkQueue file join the same run.
+    """
+    db = sqlite3.connect(path, isolation_level = None)
+    try:
+        db.execute("PRAGMA busy_timeout = 30000")
+        db.execute("CREATE TABLE IF NOT EXISTS runs (run TEXT PRIMARY KEY, started REAL, finished REAL)")
+        #BEGIN IMMEDIATE takes the write lock, so processes starting together get the same run
+        db.execute("BEGIN IMMEDIATE")
+        row = db.execute("SELECT run FROM runs WHERE finished IS NULL ORDER BY started DESC LIMIT 1").fetchone()
+        if row is None:
+            row = (time.strftime("%Y-%m-%d %H:%M:%S"),)
+            db.execute("INSERT OR IGNORE INTO runs VALUES (?, ?, NULL)", (row[0], time.time()))
+        db.execute("COMMIT")
+        return(row[0])
+    finally:
+        db.close()
+
+
+def finish_run(path, run):
+    """Marks a run as finished, the next open_run starts a new one"""
+    db = sqlite3.connect(path)
+    try:
+        db.execute("PRAGMA busy_timeout = 30000")
+        db.execute("UPDATE runs SET finished = ? WHERE run = ?", (time.time(), run))
+        db.commit()
+    finally:
+        db.close()
+
+
+#%%
+""" Object definitions """
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class CrawlJournal():
+    """SQLite journal of the state and output of every crawl task
+
+    Attributes:
+        path (str): SQLite database file
+        stage (str): Name of the crawl stage, e.g. 'urls' or 'reviews', so stages can share a file
+        max_attempts (int): Failed tasks are retried until they failed this many times
+
+    """
+    def __init__(self, path, stage, max_attempts = 3):
+        self.path = path
+        self.stage = stage
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread = False)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS tasks (
+                               stage TEXT, key TEXT, status TEXT, attempts INTEGER,
+                               output TEXT, error TEXT, updated REAL,
+                               PRIMARY KEY (stage, key))""")
+        self.db.commit()
+
+    def add(self, keys):
+        """Registers tasks as pending, tasks that are already known keep their state"""
+        with self.lock:
+            self.db.executemany("INSERT OR IGNORE INTO tasks VALUES (?, ?, ?, 0, NULL, NULL, ?)",
+                                [(self.stage, str(key), PENDING, time.time()) for key in keys])
+            self.db.commit()
+
+    def select(self, columns, keys, condition = "", parameters = ()):
+        """Returns the rows of the tasks among `keys`, queried CHUNK_SIZE keys at a time
+        Args:
+            columns: columns to select, e.g. 'key, output'
+            keys: list of key strings
+            condition: optional extra SQL condition on the tasks
+            parameters: values of the placeholders in `condition`
+        """
+        rows = []
+        with self.lock:
+            for i in range(0, len(keys), CHUNK_SIZE):
+                chunk = keys[i:i + CHUNK_SIZE]
+                rows.extend(self.db.execute(
+                    "SELECT " + columns + " FROM tasks WHERE stage = ? AND key IN (" + ", ".join("?" * len(chunk)) + ")" +
+                    (" AND " + condition if condition else ""), (self.stage, *chunk, *parameters)))
+        return(rows)
+
+    def todo(self, keys):
+        """Returns the keys that still have to be crawled, in the order of `keys`
+        Args:
+            keys: iterable of search terms or urls
+
+        Returns:
+            list of keys that are pending, or failed fewer than max_attempts times
+        """
+        keys = list(keys)
+        self.add(keys)
+        open_keys = {row[0] for row in self.select("key", list(dict.fromkeys(str(key) for key in keys)),
+                                                   "(status = ? OR (status = ? AND attempts < ?))",
+                                                   (PENDING, FAILED, self.max_attempts))}
+        return([key for key in keys if str(key) in open_keys])
+
+    def done(self, key, output):
+        """Marks a task as done and stores its (JSON serializable) output"""
+        with self.lock:
+            self.db.execute("UPDATE tasks SET status = ?, attempts = attempts + 1, output = ?, error = NULL, updated = ? "
+                            "WHERE stage = ? AND key = ?",
+                            (DONE, json.dumps(output), time.time(), self.stage, str(key)))
+            self.db.commit()
+
+    def failed(self, key, error):
+        """Marks a task as failed together with the reason"""
+        with self.lock:
+            self.db.execute("UPDATE tasks SET status = ?, attempts = attempts + 1, error = ?, updated = ? "
+                            "WHERE stage = ? AND key = ?",
+                            (FAILED, str(error), time.time(), self.stage, str(key)))
+            self.db.commit()
+
+    def outputs(self, keys):
+        """Returns the stored output of all completed tasks among `keys`
+        Returns:
+            dictionary of key to output
+        """
+        rows = self.select("key, output", list(dict.fromkeys(str(key) for key in keys)), "status = ?", (DONE,))
+        return({key: json.loads(output) for key, output in rows})
+
+    def summary(self):
+        """Returns the amount of tasks per status"""
+        with self.lock:
+            return(dict(self.db.execute("SELECT status, COUNT(*) FROM tasks WHERE stage = ? GROUP BY status",
+                                        (self.stage,)).fetchall()))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
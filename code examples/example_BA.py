@@ -9,20 +9,43 @@ Created on Mon Apr  1 12:08:43 2019
 """ Loading Required libraries & packages """ 
 import os
 import re
+import gzip
+import hashlib
 import pandas as pd
 import numpy as np
 from selenium.common.exceptions import TimeoutException
-from selenium import webdriver 
+from selenium.webdriver.common.by import By
 import time
 import threading
+import queue
+from concurrent.futures import ProcessPoolExecutor
 #from threading import Thread
 import requests
-from bs4 import BeautifulSoup
+from async_engine import AsyncFetcher
+import http_session
+from http_cache import HTTPCache
+from http_session import get_session
+from http_resolver import HTTPResolver, NeedsBrowser
+from html_parsers import get_extractor
+from record_sink import RecordSink
+from crawl_journal import CrawlJournal, finish_run, open_run
+from review_parser import REVIEW_COLUMNS, REVIEW_SELECTORS, REVIEW_TYPES, REVIEW_PATTERN, Review, failed_record, parse_reviews, timed_parse_reviews
+from scrape_metrics import METRICS
+from resilience import RESILIENCE, CircuitOpen
+from url_frontier import URLFrontier, canonicalize
+from browser_pool import BrowserPool, make_firefox
+from review_store import ReviewStore
+from incremental_crawl import IncrementalCrawl
+from name_index import NameIndex, normalize
+from work_queue import WorkQueue
 
 
 #%%
-""" Object definitions """ 
+""" Object definitions """
 
+URL_COLUMNS = ['Beer_search', 'Beer_found', 'Beer_link', 'Beer_link_N']
+URL_TYPES = {'Beer_link_N': 'int64'}
+BREAKER_WAIT = 300   # Seconds a page waits in total for the open circuit breaker of its host before it fails
 class URLScraper():
     """Scraper algorithm that finds all URLS of pages containing data
 
@@ -31,11 +54,30 @@ class URLScraper():
         attr2 (:obj:`int`, optional): Description of `attr2`.
 
     """
-    def __init__(self, N, search_array):
+    base_string = "https://www.beeradvocate.com/search/"
+    
+    def __init__(self, N, search_array, backend = 'selenium', output_path = None, journal = None,
+                 max_workers = None, scale_interval = 30, max_error_rate = 0.2, browsers = None, links = None,
+                 index = None):
         """Initializer funtion for the scraping algorithm including multi-threading
         Args:
             N: Amount of threads to be created (integer)
             search_array: Array of search terms (string)
+            backend: 'selenium' to search in a browser, 'http' to search over plain HTTP
+                     and only start a browser for pages that need JavaScript
+            output_path: optional CSV or Parquet path the results are streamed to while scraping
+            journal: optional CrawlJournal, completed search terms are skipped and failed ones retried.
+                     A WorkQueue shares the search terms with the other processes using it: the
+                     workers claim them in leased batches and compile_results merges all output
+            max_workers: maximum amount of threads the scheduler may scale up to, defaults to N
+            scale_interval: seconds between two scaling decisions of the scheduler
+            max_error_rate: share of failed search terms above which a worker is stopped
+            browsers: BrowserPool the browser searches lease a driver from, defaults to a pool
+                      of max_workers headless Firefox drivers started only when needed
+            links: optional bounded queue.Queue the output rows of every search term are put on as
+                   soon as they are found, followed by None once all workers finished
+            index: optional NameIndex, names it resolves confidently skip the search and only load
+                   their known profile page, every successful search is added to it
     
         Returns:
              List of thread objects executing scraping algorithm
@@ -43,20 +85,133 @@ class URLScraper():
         """
         
         self.search_array = search_array
+        self.backend = backend
         self.thread_list = list()    # Initiate list of threads as global
-        self.results = [{} for x in range(N)] # Initiate list of results as global such that each thread can allocate their results to it
+        self.worker_stats = []    # Throughput statistics of every worker thread
+        self.events = []    # (time, latency, failed) of every search term, used to scale the workers
+        self.failed = []    # (search term, error) of every failed search
+        self.lock = threading.Lock()
+        self.max_workers = max_workers if max_workers is not None else N
+        self.max_error_rate = max_error_rate
+        self.sink= RecordSink(URL_COLUMNS, path = output_path, types = URL_TYPES) # Shared output, flushed to disk in chunks if output_path is given
+        self.timings = []    # Page load and DOM query time per search term
+        self.journal = journal
+        self.browsers = browsers if browsers is not None else BrowserPool(size = self.max_workers, factory = self.start_driver)
+        self.links = links
+        self.index = index
+        self.restored = []    # Output rows replayed from the journal, passed on to links by the scheduler
+
+        self.shared = isinstance(journal, WorkQueue)
+        self.claim_lock = threading.Lock()
+        if self.shared:
+            #Other processes may claim any of the terms, the workers take them from the work queue
+            journal.add(search_array)
+            journal.start()
+            search_array = []
+        elif journal is not None:
+            #Replay the output of search terms completed in an earlier run and only search the rest
+            completed = journal.outputs(search_array)
+            for term in search_array:
+                if str(term) in completed:
+                    rows = [tuple(row) for row in completed[str(term)]]
+                    self.sink.extend(rows)
+                    if links is not None:
+                        self.restored.append(rows)
+            search_array = journal.todo(search_array)
+            print("Search terms left to scrape: " + str(len(search_array)))
 
-        #Split the search array into N equal sections
-        temp = np.array_split(search_array, N)
-        # Start N threads
+        #Shared work queue, idle workers pull the next search term instead of owning a fixed partition
+        self.work = queue.Queue()
+        for term in search_array:
+            self.work.put(term)
+        
+        # Start N threads and the scheduler that scales them
         for i in range(N):
-            t = threading.Thread(name='Driver {}'.format(i), target = self.scrape, args = [temp[i], i])
-            t.start()
-            time.sleep(1)
-            print("-----------------------------")
-            print(t.name + ' started!')
-            print("-----------------------------")
+            self.add_worker()
+        self.supervisor = threading.Thread(name = 'Scheduler', target = self.supervise, args = [scale_interval])
+        self.supervisor.start()
+    
+    def add_worker(self):
+        """Starts one more worker thread pulling search terms from the work queue"""
+        with self.lock:
+            index = len(self.worker_stats)
+            self.worker_stats.append({'Worker': 'Driver {}'.format(index), 'Terms': 0, 'Rows': 0, 'Errors': 0, 
+                                      'Busy_time': 0.0, 'Started': time.time(), 'Finished': None, 'Stop': False})
+            t = threading.Thread(name = 'Driver {}'.format(index), target = self.scrape, args = [index])
             self.thread_list.append(t)
+        t.start()
+        print("-----------------------------")
+        print(t.name + ' started!')
+        print("-----------------------------")
+    
+    def supervise(self, scale_interval):
+        """Scheduler loop scaling the workers on the latency and error rate of the last interval
+        
+        Adds a worker while searches succeed and the latency stays within 1.5 times the best
+        latency seen so far, stops one when the error rate exceeds max_error_rate.
+        Args:
+            scale_interval: seconds between two scaling decisions
+        """
+        try:
+            #Restored rows go on the links queue from this thread, so a full queue can not block __init__
+            for rows in self.restored:
+                self.links.put(rows)
+            self.schedule(scale_interval)
+        finally:
+            #Also after an error, the review fetchers wait for the end marker
+            if self.links is not None:
+                self.links.put(None)
+    
+    def schedule(self, scale_interval):
+        """Scaling loop of supervise, returns once every worker finished and no search term is left"""
+        best_latency = None
+        last_check = time.time()
+        restarts = 0
+        while True:
+            if all(stats['Finished'] is not None for stats in self.worker_stats):
+                #Workers that died on an error leave their search terms behind, start new ones a few times
+                if self.work.empty() or restarts >= self.max_workers:
+                    break
+                restarts += 1
+                print("All workers stopped with search terms left, restarting one")
+                self.add_worker()
+            time.sleep(min(1, scale_interval))
+            METRICS.set('queue_depth', self.work.qsize(), queue = 'search_terms')
+            METRICS.set('workers_active', sum(stats['Finished'] is None for stats in self.worker_stats))
+            METRICS.set('search_terms_per_second', METRICS.rate('search_terms_total'))
+            now = time.time()
+            if now - last_check < scale_interval:
+                continue
+            window = [event for event in self.events[-1000:] if event[0] >= last_check]
+            last_check = now
+            active = [stats for stats in self.worker_stats if stats['Finished'] is None and not stats['Stop']]
+            if not active and not self.work.empty():
+                #All workers stopped while there is work left
+                self.add_worker()
+                continue
+            if not window:
+                continue
+            latency = sum(event[1] for event in window) / len(window)
+            error_rate = sum(event[2] for event in window) / len(window)
+            if error_rate > self.max_error_rate and len(active) > 1:
+                active[-1]['Stop'] = True
+                print("Error rate " + str(round(error_rate, 2)) + ", stopping " + active[-1]['Worker'])
+            elif (error_rate == 0 and len(active) < self.max_workers and not self.work.empty() 
+                  and (best_latency is None or latency <= 1.5 * best_latency)):
+                print("Latency " + str(round(latency, 2)) + " Seconds, adding a worker")
+                self.add_worker()
+            best_latency = latency if best_latency is None else min(best_latency, latency)
+    
+    def throughput(self):
+        """Returns the throughput statistics of every worker
+        Returns:
+            dataframe with the terms, rows, errors, average latency and terms per second per worker
+        """
+        output = pd.DataFrame(self.worker_stats, columns = ['Worker', 'Terms', 'Rows', 'Errors', 'Busy_time', 'Started', 'Finished'])
+        elapsed = output['Finished'].fillna(time.time()) - output['Started']
+        output['Avg_latency'] = output['Busy_time'] / output['Terms'].where(output['Terms'] > 0)
+        output['Terms_per_sec'] = output['Terms'] / elapsed
+        return(output.drop(columns = ['Started', 'Finished']))
             
     def to_search_string(self, base_string, search_string):
         """funtion that converts search string to url
@@ -88,33 +243,28 @@ class URLScraper():
            driver: active selenium driver
     
         Returns:
-            boolean
+            list of search result web elements, or False on the profile page
         """
         if not "https://www.beeradvocate.com/beer/profile" in driver.current_url:
             #If you're not directly sent to the profile page, get all the urls web elements from the search results
-            return(driver.find_elements_by_xpath('//div[@id = "ba-content"]/div/div/span|//div[@id = "ba-content"]/div/div/a'))
+            return(driver.find_elements(By.XPATH, '//div[@id = "ba-content"]/div/div/span|//div[@id = "ba-content"]/div/div/a'))
         else:
             return(False)
     
     def page_checker_b(self, url_list, driver):
-        """Checks if we land on the beer profile page or another page
+        """Returns the first search result url, reading every href only once
         Args:
            driver: active selenium driver
-           url_list: list of urls
+           url_list: list of search result web elements
     
         Returns:
-            list of non-empty result urls
+            first non-empty result url, or False if there is none
         """
-        
         if url_list:
-            temp = []
-            for j in url_list: temp.append(j.get_attribute("href"))
-            if self.get_non_empty(temp):
-                return(self.get_non_empty(temp))
-            else: 
-                return(False)
-        else:
-            return(False)
+            first = self.get_non_empty([j.get_attribute("href") for j in url_list])
+            if first:
+                return(first)
+        return(False)
     
     def page_checker_c(self, driver):
         """Checks if last page with search results is current page, if not it return the last page url
@@ -125,28 +275,23 @@ class URLScraper():
             boolean/url
         """
         #Find the element containing the url to the last page with reviews
-        temp = driver.find_elements_by_xpath('//span/*[text() = "last"]')
+        temp = driver.find_elements(By.XPATH, '//span/*[text() = "last"]')
         if temp:
-            return(temp)
+            return(temp[0].get_attribute("href"))
         else:
             return(False)
     
-    def get_one_url(self, driver, search_term):
-        """Scrapes url if only one page with reviews
+    def build_one_url(self, search_term, beer_found, beer_link):
+        """Builds the output line for a beer with only one page with reviews
         Args:
-           driver: active selenium driver
            search_term: beer being searched for
+           beer_found: name of the beer on the profile page
+           beer_link: url of the profile page
     
         Returns:
-            dataframe object with required data
+            list with one output row (tuple in the order of URL_COLUMNS)
         """
-        beer_found = driver.find_elements_by_xpath('//h1')[0].text
-
-        df_temp = pd.DataFrame({'Beer_search': search_term, 
-                                'Beer_found': beer_found,  
-                                'Beer_link': driver.current_url, 
-                                'Beer_link_N': 0}, index = [0])
-        return(df_temp)
+        return([(search_term, beer_found, beer_link, 0)])
     
     def get_na_url(self, search_term):
         """Returns a line of NA results if no reviews were found
@@ -154,133 +299,281 @@ class URLScraper():
            search_term: beer being searched for
     
         Returns:
-            dataframe object with required data
+            list with one output row (tuple in the order of URL_COLUMNS)
         """
-        df_temp = pd.DataFrame({'Beer_search': search_term, 
-                                'Beer_found': "NA",  
-                                'Beer_link': "NA", 
-                                'Beer_link_N': 1}, index = [0])
-        return(df_temp)
+        return([(search_term, "NA", "NA", 1)])
     
-    def get_many_url(self, last_object, search_term, driver):
-        """Scrapes urls if many pages are found
+    def build_many_url(self, search_term, beer_found, last_page_url):
+        """Builds the output lines for a beer with many pages with reviews
         Args:
-           driver: active selenium driver
            search_term: beer being searched for
-           last_object: HTML object containing last page url
+           beer_found: name of the beer on the profile page
+           last_page_url: url of the last page with reviews
     
         Returns:
-            dataframe object with required data
+            list of output rows (tuples in the order of URL_COLUMNS)
         """
-        beer_found = driver.find_elements_by_xpath('//h1')[0].text
-      
-        #Get the url to the last page with reviews
-        last_page_url = last_object[0].get_attribute("href")
-    
         #Get the last number (as pages go by 25 reviews) to ease the search
         last_page_number = int(re.search("([^=]*$)", last_page_url)[1])
     
         #Build a set of urls to visit all pages that contain reviews
         pages_numbers = list(range(0,last_page_number, 25))
-        pages_links = [None]*len(pages_numbers)
-        
-        for j in range(len(pages_numbers)):
-            pages_links[j] = re.search("([^=]*)", last_page_url)[1] + '=beer&sort=&start=' + str(pages_numbers[j])
-        
-        df_temp = pd.DataFrame({'Beer_search': np.repeat(search_term, len(pages_numbers)), 
-                                'Beer_found': np.repeat(beer_found, len(pages_numbers)),  
-                                'Beer_link': pages_links, 
-                                'Beer_link_N': range(len(pages_numbers))})
-        return(df_temp)
+        base_link = re.search("([^=]*)", last_page_url)[1] + '=beer&sort=&start='
+    
+        return([(search_term, beer_found, base_link + str(number), j) for j, number in enumerate(pages_numbers)])
+    
+    def start_driver(self):
+        """Initiates a headless Firefox driver with the scraper preferences, used by the browser pool
+        Returns:
+            active selenium driver
+        """
+        #Eager page loads without images, style sheets and fonts, geckodriver is found by Selenium
+        #or taken from $GECKODRIVER_PATH
+        return(make_firefox(headless = True, page_load_strategy = 'eager', block_resources = True))
+    
+    def load_page(self, driver, url, i, timing):
+        """Directs the browser to a url and waits for the page to load, retrying timeouts with backoff
+        Args:
+           driver: active selenium driver
+           url: url to be loaded
+           i: beer being searched for
+           timing: dictionary with the timings of the search term
+        """
+        start = time.perf_counter()
+        #The browser shares the circuit breaker and pause of the host with the HTTP requests
+        RESILIENCE.call(url, lambda: driver.get(url), retry_on = (TimeoutException,), stage = 'browser')
+        self.browsers.loaded(driver)
+        METRICS.observe('browser_load', time.perf_counter() - start)
+        timing['Load_time'] += time.perf_counter() - start
+        timing['Pages'] += 1
     
-    def scrape(self, search_array, index):
-        """Main scraper function containing search logic
+    def query_page(self, timing, function, *args):
+        """Runs one DOM query on the current page and adds its duration to the timings
         Args:
-           search_array: array of search terms to scrape
-           index: thread number used in writing results to memory
+           timing: dictionary with the timings of the search term
+           function: function querying the driver
+           args: arguments passed on to function
     
         Returns:
-            boolean
+            the result of function
         """
-        
-        #Initiate scraper profile and set base search string
-        profile = webdriver.FirefoxProfile()                    
-        base_string = "https://www.beeradvocate.com/search/"    
-        
-        #Set profile preferences to disable flash and disable webrtc
-        profile.set_preference('dom.ipc.plugins.enabled.libflashplayer.so',False)
-        profile.set_preference("media.peerconnection.enabled", False)
-        profile.set_preference("http.response.timeout", 5)
-        profile.set_preference("dom.max_script_run_time", 5)
-        #profile.update_preferences()                        
+        start = time.perf_counter()
+        result = function(*args)
+        timing['Query_time'] += time.perf_counter() - start
+        return(result)
+    
+    def search_selenium(self, driver, i):
+        """Runs the search logic for one search term in the browser
+    
+        Single pass over the pages: every element set is queried once per page and
+        the result is reused, instead of asking the driver again for every check.
+        Args:
+           driver: active selenium driver
+           i: beer being searched for
+    
+        Returns:
+            list of output rows (tuples in the order of URL_COLUMNS)
+        """
+        timing = {'Beer_search': i, 'Pages': 0, 'Load_time': 0.0, 'Query_time': 0.0}
+        self.timings.append(timing)
+    
+        #State 1: search window, which may redirect straight to the profile page
+        self.load_page(driver, self.to_search_string(self.base_string, i), i, timing)
+        results = self.query_page(timing, self.page_checker_a, driver)
+    
+        if results:
+            #State 2: search results, go to the URL of the top result if there is one
+            top_result = self.query_page(timing, self.page_checker_b, results, driver)
+            if not top_result:
+                #If there are no search results, return an NA line
+                return(self.get_na_url(i))
+            self.load_page(driver, top_result, i, timing)
     
-        driver = webdriver.Firefox(firefox_profile = profile, executable_path = r'C:/Users/YoupSuurmeijer/Documents/geckodriver/geckodriver.exe') #Initiate driver
+        #State 3: profile page, read the name and the last page with reviews once
+        beer_found = self.query_page(timing, lambda: driver.find_elements(By.XPATH, '//h1')[0].text)
+        last_page_url = self.query_page(timing, self.page_checker_c, driver)
+        if last_page_url:
+            #If there are multiple pages with reviews list the pages
+            return(self.build_many_url(i, beer_found, last_page_url))
+        #If there is only one page with reviews, list the one page
+        return(self.build_one_url(i, beer_found, driver.current_url))
+    
+    def search_indexed(self, resolver, i):
+        """Builds the output for a search term from the profile the name index resolves it to
+        Args:
+           resolver: HTTPResolver object
+           i: beer being searched for
+    
+        Returns:
+            list of output rows (tuples in the order of URL_COLUMNS), None if the name has to be searched
+        """
+        match = self.index.resolve(i)
+        if match is None:
+            METRICS.inc('name_index_total', result = 'miss')
+            return(None)
+        try:
+            #Only the profile page is loaded, for the current last page with reviews
+            beer_found, beer_link, last_page_url = resolver.resolve_profile(match[1])
+        except (NeedsBrowser, requests.exceptions.RequestException) as e:
+            #The profile moved or can not be read, search for the name again
+            print("Indexed profile failed for: ", i, "(" + str(e) + ")")
+            METRICS.inc('name_index_total', result = 'stale')
+            return(None)
+        METRICS.inc('name_index_total', result = 'exact' if match[3] == normalize(i) else 'fuzzy')
+        if match[3] != normalize(i):
+            #Later runs find the variant directly, with the confidence of this match
+            self.index.add(i, beer_found, beer_link, confidence = match[2])
+        if last_page_url:
+            return(self.build_many_url(i, beer_found, last_page_url))
+        return(self.build_one_url(i, beer_found, beer_link))
+    
+    def search_http(self, resolver, i):
+        """Runs the search logic for one search term over plain HTTP
+        Args:
+           resolver: HTTPResolver object
+           i: beer being searched for
+    
+        Returns:
+            list of output rows (tuples in the order of URL_COLUMNS)
+        """
+        result = resolver.resolve(self.to_search_string(self.base_string, i))
+        if result is None:
+            #If there are no search results, append an NA line to the output dataframe
+            return(self.get_na_url(i))
+        beer_found, beer_link, last_page_url = result
+        if last_page_url:
+            return(self.build_many_url(i, beer_found, last_page_url))
+        return(self.build_one_url(i, beer_found, beer_link))
+    
+    def next_term(self):
+        """Returns the next search term, in shared mode a batch is claimed once the local queue is empty
+        Raises:
+            queue.Empty once no term is left
+        """
+        if self.shared:
+            with self.claim_lock:
+                if self.work.empty():
+                    #Waits while other processes hold the leases of the last terms
+                    for term in self.journal.claim(wait = True):
+                        self.work.put(term)
+        return(self.work.get_nowait())
+    
+    def scrape(self, index):
+        """Main scraper function containing search logic, pulls search terms until the queue is empty
+        Args:
+           index: worker number used in writing statistics to memory
+    
+        Returns:
+            boolean
+        """
+        stats = self.worker_stats[index]
+        #The name index reads the profile pages of resolved names over HTTP in both backends
+        resolver = HTTPResolver() if self.backend == 'http' or self.index is not None else None
         
-        output_searcher = pd.DataFrame(columns = ['Beer_search', 'Beer_found', 'Beer_link', 'Beer_link_N']) #Initiate output dataframe
-        start = time.time()
+        searched = set()
         
-        for i  in search_array:
-            #Direct browser to search window and wait for the page to load
-            try: 
-                driver.get(self.to_search_string(base_string, i))
-            except TimeoutException:
-                print("TimeOutExpection raised: ", i)
-                driver.get(self.to_search_string(base_string, i))
-
-            #Check if you get directed to the profile page or to the search results
-            if self.page_checker_a(driver):
-                #If you get directed to the search results, check if there are any results
-                if self.page_checker_b(self.page_checker_a(driver), driver):
-                    #If there are search results, go to the URL of the top result
-                    try: 
-                        driver.get(self.page_checker_b(self.page_checker_a(driver), driver))
-                    except TimeoutException:
-                        print("TimeOutExpection raised at getting last page: ", i)
-                        driver.get(self.page_checker_b(self.page_checker_a(driver), driver))
-                    #Check if there are multiple pages with reviews
-                    if self.page_checker_c(driver):
-                        #If there are multiple pages with reviews list the pages
-                        temp = self.get_many_url(self.page_checker_c(driver), i, driver)
-                        output_searcher = output_searcher.append(temp)
-                    else:
-                        #If there is only one page with reviews, list the one page
-                        temp = self.get_one_url(driver, i)
-                        output_searcher = output_searcher.append(temp)
-                else:
-                    #If there are no search results, append an NA line to the output dataframe
-                    temp = self.get_na_url(i)
-                    output_searcher = output_searcher.append(temp)
-            else:
-                #Check if there are multiple pages with reviews
-                if self.page_checker_c(driver):
-                    #If there are multiple pages with reviews list the pages
-                    temp = self.get_many_url(self.page_checker_c(driver), i, driver)
-                    output_searcher = output_searcher.append(temp)
-                else:
-                    #If there is only one page with reviews, scrape the one page
-                    temp = self.get_one_url(driver, i)
-                    output_searcher = output_searcher.append(temp)
+        try:
+            while not stats['Stop']:
+                try:
+                    i = self.next_term()
+                except queue.Empty:
+                    break
+                term_start = time.time()
+                searched.add(i)
+                try:
+                    #Names the index resolves confidently skip the search
+                    temp = self.search_indexed(resolver, i) if self.index is not None else None
+                    indexed = temp is not None
+                    if not indexed and self.backend == 'http':
+                        try:
+                            temp = self.search_http(resolver, i)
+                        except NeedsBrowser as e:
+                            #Fall back on the browser for pages that need JavaScript, started only once needed
+                            print("Falling back on the browser for: ", i, "(" + str(e) + ")")
+                            METRICS.inc('browser_fallbacks_total')
+                            with self.browsers.lease() as driver:
+                                temp = self.search_selenium(driver, i)
+                    elif not indexed:
+                        #A driver is only held for the duration of one search term
+                        with self.browsers.lease() as driver:
+                            temp = self.search_selenium(driver, i)
+                except Exception as e:
+                    self.term_failed(stats, i, "Search failed for: ", e, term_start)
+                    continue
+                try:
+                    if self.journal is not None:
+                        self.journal.done(i, temp)
+                    if self.index is not None and not indexed and temp[0][2] != "NA":
+                        self.index.add(i, temp[0][1], temp[0][2])
+                    self.sink.extend(temp)
+                    if self.links is not None:
+                        #Blocks while the review fetchers are behind, which slows the searches down
+                        self.links.put(temp)
+                except Exception as e:
+                    self.term_failed(stats, i, "Storing the results failed for: ", e, term_start)
+                    continue
+                stats['Terms'] += 1
+                stats['Rows'] += len(temp)
+                stats['Busy_time'] += time.time() - term_start
+                self.events.append((time.time(), time.time() - term_start, 0))
+                METRICS.inc('search_terms_total', status = 'ok')
+                METRICS.observe('search_term', time.time() - term_start, backend = self.backend)
+        except Exception as e:
+            #E.g. the shared work queue can not be read, the scheduler starts a new worker if terms are left
+            print(stats['Worker'], "stopped on an error (" + str(e) + ")")
+        finally:
+            #The scheduler and compile_results wait for every worker to be finished
+            stats['Finished'] = time.time()
 
         print("-----------------------------")
-        print("Driver ", index, "completed!")
-        print("Number of urls scraped: "  + str(len(output_searcher)))
-        print("Time elapsed: "  + str(int(time.time() - start)) + " Seconds" )
+        print(stats['Worker'], "completed!")
+        print("Number of urls scraped: "  + str(stats['Rows']))
+        print("Time elapsed: "  + str(int(time.time() - stats['Started'])) + " Seconds" )
+        thread_timings = [t for t in self.timings if t['Beer_search'] in searched]
+        if thread_timings:
+            print("Page load time: "  + str(round(sum(t['Load_time'] for t in thread_timings), 1)) + " Seconds" )
+            print("DOM query time: "  + str(round(sum(t['Query_time'] for t in thread_timings), 1)) + " Seconds" )
         print("-----------------------------")
-
-        self.results[index] = output_searcher
-        driver.close()
         return(True)
     
+    def term_failed(self, stats, i, message, error, term_start):
+        """Records a failed search term and keeps going, with a journal the term is retried in the next run"""
+        print(message, i, "(" + str(error) + ")")
+        self.failed.append((i, error))
+        if self.journal is not None:
+            try:
+                self.journal.failed(i, error)
+            except Exception as e:
+                print("Journal not updated for: ", i, "(" + str(e) + ")")
+        stats['Errors'] += 1
+        stats['Terms'] += 1
+        stats['Busy_time'] += time.time() - term_start
+        self.events.append((time.time(), time.time() - term_start, 1))
+        METRICS.inc('search_terms_total', status = 'failed')
+    
     def compile_results(self):
         """function to compile all results from seperate threads into one dataframe"""
+        #The scheduler only returns once every worker it started has finished
+        self.supervisor.join()
         for thread in self.thread_list:
             thread.join()
+        self.browsers.close()
         
-        self.output = pd.DataFrame() 
-        
-        for rslt in self.results:
-            if len(rslt) > 0:
-                self.output = pd.concat([self.output, rslt])
+        #Threads write interleaved, a stable sort restores the order of the search array
+        self.sink.close()
+        if self.shared:
+            #Merge the output of all processes from the work queue, every search term once
+            self.journal.stop()
+            completed = self.journal.outputs(self.search_array)
+            self.output = pd.DataFrame([tuple(row) for term in self.search_array for row in completed.get(str(term), [])],
+                                       columns = URL_COLUMNS)
+        else:
+            order = {term: k for k, term in enumerate(self.search_array)}
+            self.output = self.sink.to_frame().sort_values('Beer_search', kind = 'stable', 
+                                                           key = lambda terms: terms.map(order))
+
+        self.timings_output = pd.DataFrame(self.timings, columns = ['Beer_search', 'Pages', 'Load_time', 'Query_time'])
+        self.worker_output = self.throughput()
 
 class ReviewScraper():
     """Scraper algorithm that retrieves the data from all URLs obtained by URL scraper
@@ -290,59 +583,504 @@ class ReviewScraper():
         attr2 (:obj:`int`, optional): Description of `attr2`.
 
     """
-    def __init__(self, data, urls = 'Beer_link', pause = 2):
-        
-        self.data = data
-        self.urls = self.data[urls]
+    def __init__(self, data, urls = 'Beer_link', pause = 2, session = None, output_path = None, journal = None,
+                 frontier = None, store = None, recrawl = None, lean = False, spill_dir = None, parser = 'lxml'):
+        """Initializer function for the review scraper
+        Args:
+            data: dataframe with the output of the URL scraper
+            urls: name of the column containing the urls to scrape
+            pause: pause between two requests in seconds
+            session: requests session to fetch with, defaults to the shared pooled session
+            output_path: optional CSV or Parquet path the review records (REVIEW_COLUMNS only, in the order
+                         the pages finish) are streamed to as every page is fetched, so a crash keeps them.
+                         The records are not kept in memory, compile_results reads them back once. Implies
+                         lean. The search columns are only added to self.output by compile_results
+            journal: optional CrawlJournal, completed urls are restored instead of fetched again,
+                     a WorkQueue to share the urls with other processes in scrape_shared
+            frontier: URLFrontier the urls are deduplicated with, pass URLFrontier(capacity = ...)
+                      to use a Bloom filter on very large runs
+            store: optional ReviewStore the compiled reviews are appended to as typed Parquet
+            recrawl: optional IncrementalCrawl, only pages that can hold new reviews are fetched
+                     and only the new reviews are merged into its store
+            lean: extract the review fields right after every fetch into compact Review records
+                  instead of keeping the parsed pages until compile_results
+            spill_dir: optional directory the raw pages are written to gzip compressed
+            parser: parser backend of the pages in every mode ('lxml', 'bs4' or 'selectolax'), see
+                    benchmarks/bench_parsers.py for the fastest one on the pages at hand
+        """
+        self.recrawl = recrawl
+        self.data = recrawl.plan(data, urls) if recrawl is not None else data
+        self.session = session if session is not None else get_session()
+        self.url_column = urls
+        self.store = store
+        #Many search terms resolve to the same beer: every canonical url is fetched only once
+        self.frontier = frontier if frontier is not None else URLFrontier()
+        self.urls = self.frontier.dedupe(self.data[urls])
+        print("Unique urls to scrape: " + str(len(self.urls)) + " of " + str(len(self.data)))
         self.pause = pause
+        self.output_path = output_path
+        self.sink = RecordSink(REVIEW_COLUMNS, path = output_path, types = REVIEW_TYPES) if output_path is not None else None
+        self.journal = journal
         self.reviews = []
         self.counter = 0
+        self.started = time.time()
+        self.failed = []    # (url, reason) of every page that could not be retrieved, after all retries
+        self.lean = lean or output_path is not None
+        self.spill_dir = spill_dir
+        self.parser = parser
+        self.extractor = get_extractor(REVIEW_SELECTORS, parser)
+        if spill_dir is not None:
+            os.makedirs(spill_dir, exist_ok = True)
+        #Lean mode keeps the extracted records, otherwise the raw html and the review tags
+        self.columns = REVIEW_COLUMNS if self.lean else ['url', 'html', 'review']
         
     def scrape(self):
         """ Main scraper function containing search logic retrieves raw HTML """
-        for url in self.urls:
-            temp = requests.get(url)
-            self.counter += 1
-            print(self.counter, "/", len(self.urls), " completed")
+        for url in self.restore():
+            temp = self.fetch(url)
+            self.progress()
             time.sleep(self.pause)
-            
-            if temp.ok:
-                html = BeautifulSoup(temp.text, 'html.parser')
-                review = html.findAll("div", class_ = "user-comment")
-                temp_output = pd.DataFrame({'url' : url, 'html' : html.content, 'review' : review})
-                self.reviews.append(temp_output)
-            else:
-                temp_output = pd.DataFrame({'url' : url, 'html' : "N/A", 'review' : "N/A"}, index = [0])
-                self.reviews.append(temp_output)
-                
-        self.reviews = pd.concat(self.reviews)
+            self.reviews.extend(self.record(url, temp))
+    
+        self.reviews = pd.DataFrame(self.reviews, columns = self.columns)
         print("----------------------")
         print("Scraper complete!")
+        print("Pages failed: " + str(len(self.failed)))
         print("----------------------")
         
-    def compile_results(self):
-        """function to convert all HTML into required data and list into one dataframe"""
-        self.output = []
+    def scrape_shared(self, poll = 5):
+        """Scraper for one of several processes sharing the urls through a WorkQueue journal
         
-        for i in range(len(self.reviews)):
-            review = self.reviews['review'].iloc[i]
-            url = self.reviews['url'].iloc[i]
-            
-            temp_text = re.search(r'overall: \d+(.*?)character', review.text).group(1) if re.search(r'overall: \d+(.*?)character', review.text) is not None else "N/A"
-            temp_date = ','.join(review.text.split(",")[-2:])
-            temp_overall = review.find("span", class_ = "BAscore_norm").text
-            temp_rdev = review.find("span", class_ = "rAvg_norm").text
-            temp_look = re.search('look: (\d+\.?\d?)', review.text).group(1) if re.search('look: (\d+\.?\d?)', review.text) is not None else "N/A"
-            temp_feel = re.search('feel: (\d+\.?\d?)', review.text).group(1) if re.search('feel: (\d+\.?\d?)', review.text) is not None else "N/A"
-            temp_smell = re.search('smell: (\d+\.?\d?)', review.text).group(1) if re.search('smell: (\d+\.?\d?)', review.text) is not None else "N/A"
-            temp_taste = re.search('taste: (\d+\.?\d?)', review.text).group(1) if re.search('taste: (\d+\.?\d?)', review.text) is not None else "N/A"
-                      
-            temp_output = pd.DataFrame({'Overall' : temp_overall, 'Rdev' : temp_rdev, 'Text' : temp_text, 
-                                        'Look' : temp_look, 'Feel' : temp_feel, 'Smell' : temp_smell, 
-                                        'Taste' : temp_taste, 'Date': temp_date, 'url' : url} , index = [0])
-            self.output.append(temp_output)
-        self.output = pd.concat(self.output)
-        self.output = pd.merge(self.output, self.data, how='left', left_on= ['url'], right_on = 'Beer_link')
+        Urls are claimed in leased batches, the other processes using the same queue take the
+        rest and the leases of a process that stopped are taken over once they expire. When no
+        url is left, the reviews of all processes are collected from the queue, every url once.
+        Args:
+            poll: seconds between two claims while other processes hold the last urls
+        """
+        self.journal.add(self.urls)
+        self.started = time.time()
+        self.journal.start()
+        try:
+            for url in self.journal.tasks(poll = poll):
+                temp = self.fetch(url)
+                self.progress()
+                time.sleep(self.pause)
+                self.record(url, temp)
+        finally:
+            self.journal.stop()
+    
+        #Collect the pages of all processes, pages that failed for good get the usual N/A row
+        completed = self.journal.outputs(self.urls)
+        if self.sink is not None:
+            #Start the output file over with the pages of all processes, in the order of the urls
+            self.sink = RecordSink(REVIEW_COLUMNS, path = self.output_path, types = REVIEW_TYPES)
+        rows = []
+        for url in self.urls:
+            rows.extend(self.keep(self.restore_page(url, completed[url]) if url in completed else self.failed_rows(url)))
+        self.reviews = pd.DataFrame(rows, columns = self.columns)
+        print("----------------------")
+        print("Scraper complete!")
+        print("Pages failed: " + str(len(self.failed)))
+        print("----------------------")
+        
+    def scrape_stream(self, links, fetchers = 4):
+        """Scraper fetching the review pages while the URL scraper is still searching
+        
+        Reads the output rows of every search term from the links queue of a URLScraper,
+        deduplicates their urls and fetches them right away. The queue is bounded, so the
+        searches slow down when the fetchers fall behind. self.data and self.urls are
+        rebuilt from what came through the queue.
+        Args:
+            links: queue.Queue passed to URLScraper(links = ...), ended by None
+            fetchers: amount of fetcher threads (integer)
+        """
+        self.started = time.time()
+        self.urls = []
+        rows = []       # URL scraper output rows in the order they arrived
+        pages = {}      # Review rows of every url fetched or restored
+        lock = threading.Lock()
+        
+        def fetch():
+            while True:
+                batch = links.get()
+                if batch is None:
+                    #Put the end marker back for the other fetchers
+                    links.put(None)
+                    return
+                #Any error is recorded and the fetcher keeps reading, a dead fetcher would block
+                #the URL scraper on the full links queue
+                try:
+                    data = pd.DataFrame(batch, columns = URL_COLUMNS)
+                    with lock:
+                        rows.extend(batch)
+                        if self.recrawl is not None:
+                            data = self.recrawl.plan(data, self.url_column)
+                        urls = self.frontier.dedupe(data[self.url_column])
+                        self.urls.extend(urls)
+                    if self.journal is not None:
+                        completed = self.journal.outputs(urls)
+                        todo = self.journal.todo(urls)
+                        for url in completed:
+                            pages[url] = self.keep(self.restore_page(url, completed[url]))
+                    else:
+                        todo = urls
+                except Exception as e:
+                    for url in dict.fromkeys(row[2] for row in batch):
+                        self.fail(url, e)
+                    continue
+                for url in todo:
+                    try:
+                        resp = self.fetch(url)
+                        self.progress()
+                        time.sleep(self.pause)
+                        pages[url] = self.record(url, resp)
+                    except Exception as e:
+                        pages[url] = self.keep(self.failed_rows(url))
+                        self.fail(url, e)
+        
+        threads = [threading.Thread(target = fetch, daemon = True) for i in range(fetchers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.data = pd.DataFrame(rows, columns = URL_COLUMNS)
+        self.reviews = pd.DataFrame([row for url in self.urls for row in pages.get(url, [])], columns = self.columns)
+        print("----------------------")
+        print("Scraper complete!")
+        print("Pages failed: " + str(len(self.failed)))
+        print("----------------------")
+        
+    def scrape_async(self, concurrency = 10, per_host = 4, rate = None, burst = 1):
+        """Asynchronous variant of scrape keeping many requests in flight
+        Args:
+            concurrency: maximum amount of requests in flight (integer)
+            per_host: maximum amount of requests in flight per host (integer)
+            rate: maximum requests per second per host, defaults to 1 / pause
+            burst: amount of requests per host that may be sent back to back
+    
+        Returns:
+            None, the raw results are stored in self.reviews like scrape does
+        """
+        if rate is None and self.pause:
+            rate = 1 / self.pause
+        fetcher = AsyncFetcher(concurrency = concurrency, per_host = per_host, 
+                               rate = rate, burst = burst, get = self.fetch)
+        
+        urls = self.restore()
+        rows = {}
+        
+        def progress(url, resp):
+            #Parse and journal every page as soon as it arrives
+            self.progress()
+            rows[url] = self.record(url, resp)
+        
+        fetcher.run(urls, callback = progress)
+        for url in urls:
+            self.reviews.extend(rows[url])
+        self.reviews = pd.DataFrame(self.reviews, columns = self.columns)
+        print("----------------------")
+        print("Scraper complete!")
+        print("Pages failed: " + str(len(self.failed)))
+        print("----------------------")
+        
+    def scrape_pipeline(self, fetchers = 4, parsers = None, queue_size = 64):
+        """Scraper with fetching and parsing decoupled into a producer/consumer pipeline
+        
+        Fetcher threads push the raw bytes of every page onto a bounded queue, a process pool
+        parses them with the parser backend and only passes plain review records back. self.reviews then holds
+        the extracted REVIEW_COLUMNS instead of parsed review elements.
+        Args:
+            fetchers: amount of fetcher threads (integer)
+            parsers: amount of parser processes, defaults to the amount of cores
+            queue_size: maximum amount of pages waiting to be parsed (integer)
+        """
+        self.started = time.time()
+        if self.journal is not None:
+            completed = self.journal.outputs(self.urls)
+            urls = self.journal.todo(self.urls)
+            print("Urls restored from the journal: " + str(len(completed)) + ", left to fetch: " + str(len(urls)))
+        else:
+            completed, urls = {}, list(self.urls)
+        
+        url_queue = queue.Queue()
+        for url in urls:
+            url_queue.put(url)
+        pages = queue.Queue(maxsize = queue_size)
+        
+        def fetch():
+            while True:
+                try:
+                    url = url_queue.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    resp = self.fetch(url)
+                    if isinstance(resp, Exception):
+                        raise resp
+                    if resp.ok:
+                        self.spill(url, resp.content)
+                    pages.put((url, resp.content if resp.ok else None, None if resp.ok else resp.status_code))
+                except Exception as e:
+                    #Any error has to reach the consumer, otherwise it waits for this page forever
+                    pages.put((url, None, e))
+                METRICS.set('queue_depth', pages.qsize(), queue = 'pages')
+                time.sleep(self.pause)
+        
+        threads = [threading.Thread(name = 'Fetcher {}'.format(i), target = fetch) for i in range(fetchers)]
+        for t in threads:
+            t.start()
+        
+        records = {}
+        in_flight = threading.BoundedSemaphore(queue_size)
+        
+        def parsed(url, future):
+            in_flight.release()
+            try:
+                rows, html, seconds = future.result()
+            except Exception as e:
+                records[url] = self.keep([failed_record(url)])
+                self.fail(url, e)
+                return
+            METRICS.observe('parse', seconds, parser = self.parser)
+            records[url] = self.keep(rows)
+            if self.journal is not None and html is not None:
+                self.journal.done(url, html)
+        
+        def submit(url, body, keep_html):
+            #Blocks while queue_size pages are being parsed, which in turn blocks the fetchers
+            in_flight.acquire()
+            future = pool.submit(timed_parse_reviews, url, body, keep_html, self.parser)
+            future.add_done_callback(lambda future: parsed(url, future))
+        
+        with ProcessPoolExecutor(max_workers = parsers) as pool:
+            for url, reviews in completed.items():
+                submit(url, '<html><body>' + ''.join(reviews) + '</body></html>', False)
+            for _ in range(len(urls)):
+                url, body, error = pages.get()
+                self.progress()
+                if body is None:
+                    records[url] = self.keep([failed_record(url)])
+                    self.fail(url, error)
+                else:
+                    submit(url, body, self.journal is not None)
+        for t in threads:
+            t.join()
+        
+        self.reviews = pd.DataFrame([row for url in dict.fromkeys(self.urls) if url in records for row in records[url]],
+                                    columns = REVIEW_COLUMNS)
+        print("----------------------")
+        print("Scraper complete!")
+        print("Pages failed: " + str(len(self.failed)))
+        print("----------------------")
+        
+    def fetch(self, url, **kwargs):
+        """Fetches one page, waiting for the circuit breaker of its host while that is open
+        
+        Every fetch path goes through here, so an open breaker holds the page back instead of
+        failing it, for at most BREAKER_WAIT seconds.
+        Args:
+            url: url of the page
+            kwargs: keyword arguments of requests.Session.get, e.g. the timeout of the async engine
+    
+        Returns:
+            requests response object, or the exception raised after all retries
+        """
+        deadline = time.monotonic() + BREAKER_WAIT
+        while True:
+            try:
+                return(self.session.get(url, **kwargs))
+            except CircuitOpen as e:
+                if time.monotonic() + e.retry_in > deadline:
+                    return(e)
+                #A run of failing pages opened the breaker, give the host the time to recover,
+                #a trial request of another page may be running, check again shortly after it
+                print("Circuit breaker open, waiting " + str(round(e.retry_in, 1)) + " seconds for: ", url)
+                time.sleep(max(e.retry_in, 0.5))
+            except requests.exceptions.RequestException as e:
+                return(e)
+        
+    def progress(self):
+        """Counts one finished page, updates the progress gauges and prints the progress"""
+        self.counter += 1
+        METRICS.inc('pages_total')
+        METRICS.set('pages_left', len(self.urls) - self.counter)
+        METRICS.set('pages_per_second', self.counter / max(time.time() - self.started, 1e-9))
+        print(self.counter, "/", len(self.urls), " completed")
+        
+    def restore(self):
+        """Restores the reviews of urls completed in an earlier run from the journal
+        Returns:
+            list of urls that still have to be fetched
+        """
+        self.reviews = []
+        self.started = time.time()
+        if self.journal is None:
+            return(list(self.urls))
+        completed = self.journal.outputs(self.urls)
+        #Restore in the order of the urls, like a fresh run would have fetched them
+        for url in self.urls:
+            if url not in completed:
+                continue
+            self.reviews.extend(self.keep(self.restore_page(url, completed[url])))
+        todo = self.journal.todo(self.urls)
+        print("Urls restored from the journal: " + str(len(completed)) + ", left to fetch: " + str(len(todo)))
+        return(todo)
+        
+    def restore_page(self, url, reviews):
+        """Rebuilds the rows of one page from the review html stored in the journal"""
+        if self.lean:
+            records, _ = parse_reviews(url, '<html><body>' + ''.join(reviews) + '</body></html>', backend = self.parser)
+            return([Review(*record) for record in records])
+        doc = self.extractor.parse('<html><body>' + ''.join(reviews) + '</body></html>')
+        return([(url, None, review) for review in self.extractor.select('reviews', doc)])
+        
+    def failed_rows(self, url):
+        """Returns the rows of a page that could not be retrieved"""
+        return(self.extract_response(url, None)[0] if self.lean else self.parse_response(url, None))
+        
+    def record(self, url, resp):
+        """Parses one response and records the outcome in the journal
+        Args:
+            url: requested url
+            resp: requests response object, or the exception raised while fetching
+    
+        Returns:
+            list of (url, html, review) tuples as returned by parse_response, Review records in lean mode
+        """
+        if self.lean:
+            rows, html = self.extract_response(url, resp)
+        else:
+            rows = self.parse_response(url, resp)
+            html = [self.extractor.html(row[2]) for row in rows if not isinstance(row[2], str)]
+        if isinstance(resp, requests.Response) and resp.ok:
+            if self.journal is not None:
+                self.journal.done(url, html)
+        else:
+            self.fail(url, resp.status_code if isinstance(resp, requests.Response) else resp)
+        return(self.keep(rows))
+        
+    def keep(self, rows):
+        """Streams the records of one page to the output_path sink, if there is one
+        Returns:
+            the rows to keep in memory, none once they are on their way to disk
+        """
+        if self.sink is None:
+            return(rows)
+        self.sink.extend(rows)
+        return([])
+        
+    def fail(self, url, reason):
+        """Records a page that could not be retrieved after all retries, so it is not dropped silently"""
+        print("Failed to retrieve: ", url, "(" + str(reason) + ")")
+        self.failed.append((url, reason))
+        METRICS.inc('pages_failed_total')
+        if self.journal is not None:
+            self.journal.failed(url, reason)
+        
+    def parse_response(self, url, resp):
+        """Converts one response into the raw review rows
+        Args:
+            url: requested url
+            resp: requests response object, or the exception raised while fetching
+    
+        Returns:
+            list of (url, html, review) tuples, one per review element
+        """
+        if isinstance(resp, requests.Response) and resp.ok:
+            with METRICS.span('parse', parser = self.parser):
+                html = self.extractor.parse(resp.content)
+                review = self.extractor.select('reviews', html)
+            return([(url, html, r) for r in review])
+        else:
+            return([(url, "N/A", "N/A")])
+        
+    def extract_response(self, url, resp):
+        """Extracts the review records of one response right away, so the page itself can be released
+        Args:
+            url: requested url
+            resp: requests response object, or the exception raised while fetching
+    
+        Returns:
+            tuple of the list of Review records and the review HTML strings for the journal
+        """
+        if isinstance(resp, requests.Response) and resp.ok:
+            self.spill(url, resp.content)
+            with METRICS.span('parse', parser = self.parser):
+                records, html = parse_reviews(url, resp.content, keep_html = self.journal is not None,
+                                              backend = self.parser)
+            return([Review(*record) for record in records], html)
+        return([Review(*failed_record(url))], None)
+        
+    def spill(self, url, body):
+        """Writes a raw page gzip compressed to spill_dir, named after the hash of its url"""
+        if self.spill_dir is None:
+            return
+        path = os.path.join(self.spill_dir, hashlib.sha1(url.encode('utf-8')).hexdigest() + ".html.gz")
+        with gzip.open(path, 'wb') as f:
+            f.write(body)
+        
+    def extract_reviews(self, reviews):
+        """Extracts the review fields of a batch of raw reviews in one vectorized pass
+        Args:
+            reviews: dataframe with the url and review columns of self.reviews
+    
+        Returns:
+            dataframe object with REVIEW_COLUMNS, scores as numeric columns
+        """
+        #The spans are the only fields that need the HTML, everything else comes from the text
+        texts, overall, rdev = [], [], []
+        for review in reviews['review']:
+            if isinstance(review, str):
+                #Pages that could not be retrieved
+                texts.append(None), overall.append(None), rdev.append(None)
+                continue
+            texts.append(self.extractor.text(review))
+            span = self.extractor.first('overall', review)
+            overall.append(self.extractor.text(span) if span is not None else None)
+            span = self.extractor.first('rdev', review)
+            rdev.append(self.extractor.text(span) if span is not None else None)
+        
+        texts = pd.Series(texts, index = reviews.index, dtype = object)
+        fields = texts.str.extract(REVIEW_PATTERN)
+        
+        output = pd.DataFrame({'Overall' : pd.to_numeric(pd.Series(overall, index = reviews.index), errors = 'coerce'), 
+                               'Rdev' : pd.to_numeric(pd.Series(rdev, index = reviews.index, dtype = object).str.rstrip('%'), errors = 'coerce'), 
+                               'Text' : fields['Text'].fillna("N/A"), 
+                               'Look' : pd.to_numeric(fields['Look']), 
+                               'Feel' : pd.to_numeric(fields['Feel']), 
+                               'Smell' : pd.to_numeric(fields['Smell']), 
+                               'Taste' : pd.to_numeric(fields['Taste']), 
+                               'Date' : texts.str.split(",").str[-2:].str.join(","), 
+                               'url' : reviews['url']})
+        return(output[REVIEW_COLUMNS])
+        
+    def compile_results(self, batch_size = 50000):
+        """function to convert all HTML into required data and list into one dataframe
+        Args:
+            batch_size: amount of reviews extracted per vectorized batch
+        """
+        if self.sink is not None:
+            #The records were streamed to output_path instead of kept in memory
+            self.sink.close()
+            self.reviews = self.sink.to_frame()
+        
+        batches = []
+        for start in range(0, len(self.reviews), batch_size):
+            batch = self.reviews.iloc[start:start + batch_size]
+            if 'review' in batch.columns:
+                batch = self.extract_reviews(batch)
+            #Otherwise the records were already extracted in lean mode or by scrape_pipeline
+            batches.append(batch)
+        self.output = pd.concat(batches, ignore_index = True) if batches else pd.DataFrame(columns = REVIEW_COLUMNS)
+        #Attach every search term whose url has the same canonical form as the fetched one
+        self.output = pd.merge(self.output.assign(url_key = self.output['url'].map(canonicalize)),
+                               self.data.assign(url_key = self.data[self.url_column].map(canonicalize)),
+                               how='left', on = 'url_key').drop(columns = 'url_key')
+        if self.recrawl is not None:
+            print("New reviews stored: " + str(self.recrawl.merge(self.output, [url for url, reason in self.failed])))
+        elif self.store is not None:
+            print("Reviews stored: " + str(self.store.append(self.output)))
             
 
 #%%
@@ -350,6 +1088,15 @@ if __name__ == '__main__':
     """" Other Preparations & Data Load """
     os.chdir("C:/Users/YoupSuurmeijer/Documents/Swinckels/Supermarkt/Data")
     
+    #Cache all pages on disk, re-runs only revalidate pages older than a day. Profile and review pages
+    #are always revalidated, the recrawl has to see their current last page and newest reviews
+    http_session.configure(cache = HTTPCache("http_cache", ttl = 24 * 3600, max_size = 2 * 1024**3,
+                                             revalidate = r"/beer/profile/"))
+    
+    #Request spans go to a JSON-lines log, counters and gauges to http://127.0.0.1:9108/metrics
+    METRICS.open_jsonl("scrape_metrics.jsonl")
+    METRICS.serve(9108)
+    
     df_class = pd.read_csv("beer_classification.csv", sep = ";") 
     df_class['ProdName'] = df_class['Product_MAJOR_BRAND'] + " " + df_class['Product_VARIANT']
     
@@ -359,26 +1106,52 @@ if __name__ == '__main__':
     """" Running the URL search string algorithm"""
     search_array = name_array[0:200]
     N = 2   # Number of browsers to spawn
+    EXPORT_URLS = False   # Also write the URL scraper output to csv
+    SHARED_QUEUE = None   # Path of a WorkQueue database to crawl together with other processes
     
-    url_scraper = URLScraper(N, search_array)
-    url_scraper.compile_results()
-    
-    """" Exporting the results to csv """
-    name = ("C:/Users/YoupSuurmeijer/Documents/Swinckels/Supermarkt/Data/" + "URL - " + 
-            url_scraper.output['Beer_search'].iloc[0] + " - " + 
-            url_scraper.output['Beer_search'].iloc[-1] + ".csv")
-    url_scraper.output.to_csv(path_or_buf = name, sep = ";")
+    #Journal of the crawl state, a restarted run skips everything it completed before, also after midnight,
+    #until the run is finished
+    journal_path = SHARED_QUEUE if SHARED_QUEUE is not None else "crawl_journal.sqlite"
+    run = open_run(journal_path)
+    if SHARED_QUEUE is not None:
+        #Every process started on the same queue takes its share of the search terms and urls and
+        #merges the output of all of them, the first one done stores the reviews
+        url_scraper = URLScraper(N, search_array, journal = WorkQueue(SHARED_QUEUE, "urls " + run),
+                                 index = NameIndex("name_index.sqlite"))
+        url_scraper.compile_results()
+        reviews_queue = WorkQueue(SHARED_QUEUE, "reviews " + run)
+        review_scraper = ReviewScraper(url_scraper.output, pause = 1, journal = reviews_queue, lean = True)
+        review_scraper.scrape_shared()
+    else:
+        #The review pages of every search term are fetched as soon as its urls are found,
+        #at most 100 search terms wait for the review fetchers before the searches are held up
+        links = queue.Queue(maxsize = 100)
+        #Names resolved in earlier runs only load their profile page, only new names are searched
+        url_scraper = URLScraper(N, search_array, journal = CrawlJournal("crawl_journal.sqlite", "urls " + run),
+                                 links = links, index = NameIndex("name_index.sqlite"))
 
-    """" Running the data retrieval algorithm"""
-    review_scraper = ReviewScraper(url_scraper.output, pause = 1)
-    review_scraper.scrape()
-    review_scraper.compile_results()
+        """" Running the data retrieval algorithm"""
+        #Reviews are appended to a typed Parquet dataset partitioned by beer instead of a CSV export,
+        #a daily re-run only fetches the first pages of every beer and adds the reviews that are new
+        review_scraper = ReviewScraper(pd.DataFrame(columns = URL_COLUMNS), pause = 1, 
+                                       journal = CrawlJournal("crawl_journal.sqlite", "reviews " + run),
+                                       recrawl = IncrementalCrawl("recrawl_state.sqlite", ReviewStore("reviews")),
+                                       lean = True)
+        review_scraper.scrape_stream(links, fetchers = 2)
+        url_scraper.compile_results()
     
     """" Exporting the results to csv """
-    name = ("C:/Users/YoupSuurmeijer/Documents/Swinckels/Supermarkt/Data/" +  "DATA - " +
-            review_scraper.output['Beer_search'].iloc[0] + " - " + 
-            review_scraper.output['Beer_search'].iloc[-1] + ".csv")
+    if EXPORT_URLS:
+        name = ("C:/Users/YoupSuurmeijer/Documents/Swinckels/Supermarkt/Data/" + "URL - " + 
+                url_scraper.output['Beer_search'].iloc[0] + " - " + 
+                url_scraper.output['Beer_search'].iloc[-1] + ".csv")
+        url_scraper.output.to_csv(path_or_buf = name, sep = ";")
     
-    review_scraper.output.to_csv(path_or_buf = name, sep = ";")
+    review_scraper.compile_results()
+    if SHARED_QUEUE is None:
+        finish_run(journal_path, run)
+    elif reviews_queue.once("store"):
+        ReviewStore("reviews").append(review_scraper.output)
+        finish_run(journal_path, run)
 
 
@@ -5,20 +5,36 @@ Created on Tue Apr 23 12:15:10 2019
 @author: YoupSuurmeijer
 """
 
-from requests import get
 from requests.exceptions import RequestException
 from contextlib import closing
-from bs4 import BeautifulSoup
+from lxml import etree
 import re
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import http_session
+from http_cache import HTTPCache
+from http_session import get_session
+from html_parsers import get_extractor
+from scrape_metrics import METRICS
 
-def simple_get(url):
+logger = logging.getLogger(__name__)
+
+# Pages the names and the hit counts are read from
+NAMES_URL = 'http://www.fabpedigree.com/james/mathmen.htm'
+HITS_URL_ROOT = 'https://www.torontopubliclibrary.ca/search.jsp?Ntt={name}'
+
+def simple_get(url, timeout=None):
     """
     Attempts to get the content at `url` by making an HTTP GET request.
     If the content-type of response is some kind of HTML/XML, return the
     text content, otherwise return None.
+    Requests go through the shared keep-alive session of http_session.
     """
     try:
-        with closing(get(url, stream=True)) as resp:
+        with closing(get_session().get(url, stream=True, timeout=timeout)) as resp:
             if is_good_response(resp):
                 return resp.content
             else:
@@ -29,6 +45,78 @@ def simple_get(url):
         return None
 
 
+def stream_texts(url, tag, class_name=None, limit=None, timeout=None, chunk_size=16384):
+    """
+    Streams the page at `url` through an incremental lxml parser and
+    yields the text of every `tag` element, only of those with
+    `class_name` in their class attribute if it is given. Stops
+    reading the body once `limit` elements were found. Yields nothing
+    if the page could not be retrieved or is not HTML.
+    With a cache configured the first fetch still reads the whole body
+    to store it; later fetches replay it from disk.
+    """
+    parse_time = 0.0
+    try:
+        with closing(get_session().get(url, stream=True, timeout=timeout)) as resp:
+            if not is_good_response(resp):
+                return
+            # Only pass an encoding the server declared, otherwise lxml reads the meta tags
+            encoding = resp.encoding if 'charset' in resp.headers['Content-Type'].lower() else None
+            parser = etree.HTMLPullParser(events=('end',), tag=tag, encoding=encoding)
+            found = 0
+            chunks = resp.iter_content(chunk_size)
+            while True:
+                chunk = next(chunks, None)
+                start = time.perf_counter()
+                if chunk is None:
+                    parser.close()
+                else:
+                    parser.feed(chunk)
+                events = list(parser.read_events())
+                parse_time += time.perf_counter() - start
+                for _, element in events:
+                    if class_name is None or class_name in (element.get('class') or '').split():
+                        yield ''.join(element.itertext())
+                        found += 1
+                        if limit is not None and found >= limit:
+                            return
+                    # Free finished elements, unless an enclosing one still needs their text
+                    if next(element.iterancestors(tag), None) is None:
+                        element.clear(keep_tail=True)
+                if chunk is None:
+                    return
+
+    except RequestException as e:
+        log_error('Error during requests to {0} : {1}'.format(url, str(e)))
+    finally:
+        METRICS.observe('parse', parse_time, parser='lxml-stream')
+
+
+def select_texts(url, css, parser, limit=None, timeout=None):
+    """
+    Fetches the page at `url` in one piece and returns the text of the
+    elements matching the selector `css`, parsed with the `parser`
+    backend of html_parsers ('lxml', 'bs4' or 'selectolax'). Returns
+    an empty list if the page could not be retrieved or is not HTML.
+    """
+    try:
+        with closing(get_session().get(url, timeout=timeout)) as resp:
+            if not is_good_response(resp):
+                return []
+            # Same decoding as stream_texts: only an encoding the server declared
+            encoding = resp.encoding if 'charset' in resp.headers['Content-Type'].lower() else None
+            body = resp.content
+    except RequestException as e:
+        log_error('Error during requests to {0} : {1}'.format(url, str(e)))
+        return []
+
+    # The selector is compiled once per backend and reused for every page
+    extractor = get_extractor({'items': css}, parser)
+    with METRICS.span('parse', parser=parser):
+        nodes = extractor.select('items', extractor.parse(body, encoding))
+        return [extractor.text(node) for node in nodes[:limit]]
+
+
 def is_good_response(resp):
     """
     Returns True if the response seems to be HTML, False otherwise.
@@ -43,52 +131,54 @@ def is_good_response(resp):
 def log_error(e):
     """
     It is always a good idea to log errors. 
-    This function just prints them, but you can
-    make it do anything.
+    This function logs them and counts them in
+    the errors_total metric.
     """
-    print(e)
+    METRICS.inc('errors_total', script='mathematicians')
+    METRICS.event('error', message=str(e))
+    logger.error(e)
     
-def get_names():
+def get_names(parser=None):
     """
     Downloads the page where the list of mathematicians is found
-    and returns a list of strings, one per mathematician
-    """
-    url = 'http://www.fabpedigree.com/james/mathmen.htm'
-    response = simple_get(url)
-
-    if response is not None:
-        html = BeautifulSoup(response, 'html.parser')
-        names = set()
-        for li in html.select('li'):
-            for name in li.text.split('\n'):
-                if len(name) > 0:
-                    names.add(name.strip())
+    and returns a list of strings, one per mathematician. The page
+    is streamed through lxml, unless a `parser` backend is given.
+    """
+    url = NAMES_URL
+    names = set()
+    texts = stream_texts(url, 'li') if parser is None else select_texts(url, 'li', parser)
+    for text in texts:
+        for name in text.split('\n'):
+            if len(name) > 0:
+                names.add(name.strip())
+
+    if names:
         return list(names)
 
     # Raise an exception if we failed to get any data from the url
     raise Exception('Error retrieving contents at {}'.format(url))
 
     
-def get_hits_on_name(name):
+def get_hits_on_name(name, timeout=None, parser=None):
     """
     Accepts a `name` of a mathematician and returns the number
-    of search results for the Toronto Public Library website as an `int`
+    of search results for the Toronto Public Library website as an `int`.
+    The page is streamed through lxml, unless a `parser` backend is given.
     """
     # url_root is a template string that is used to build a URL.
-    url_root = 'https://www.torontopubliclibrary.ca/search.jsp?Ntt={name}'
+    url_root = HITS_URL_ROOT
     name = name.replace(" ", "+")
     url = url_root.format(name=name)
     print("GET request for: ", url)
-    response = simple_get(url)
-
-    if response is not None:
-        html = BeautifulSoup(response, 'html.parser')
 
-        hit_link = html.find("h3", {"class": "item-count"})
-
-        if len(hit_link) > 0:
+    # Only the first h3.item-count is needed, when streaming the rest of the page is never read
+    if parser is None:
+        texts = stream_texts(url, 'h3', class_name='item-count', limit=1, timeout=timeout)
+    else:
+        texts = select_texts(url, 'h3.item-count', parser, limit=1, timeout=timeout)
+    for link_text in texts:
+        if len(link_text) > 0:
             # Strip all non alpha-numeric characters (note I'm using Regex!)
-            link_text = hit_link.text
             link_text = re.sub('[^0-9]','', link_text)
             try:
                 # Convert to integer
@@ -99,40 +189,80 @@ def get_hits_on_name(name):
     log_error('No pageviews found for {}'.format(name))
     return None
 
+
+def get_hits_on_names(names, workers=8, rate=None, timeout=10, parser=None):
+    """
+    Looks up the hits of many names concurrently and yields
+    (name, hits) tuples in the order the lookups complete.
+    `workers` lookups run at the same time, `rate` caps the
+    amount of requests per second (None for no limit) and
+    `timeout` is the timeout in seconds of every request and `parser`
+    the parser backend passed on to get_hits_on_name.
+    A name whose lookup failed is yielded with hits None.
+    """
+    lock = threading.Lock()
+    next_slot = [time.monotonic()]
+
+    def lookup(name):
+        if rate:
+            # Reserve the next free request slot and wait for it
+            with lock:
+                slot = max(next_slot[0], time.monotonic())
+                next_slot[0] = slot + 1 / rate
+            time.sleep(max(0, slot - time.monotonic()))
+        return get_hits_on_name(name, timeout=timeout, parser=parser)
+
+    pool = ThreadPoolExecutor(max_workers=workers)
+    try:
+        futures = {pool.submit(lookup, name): name for name in names}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                yield name, future.result()
+            except Exception:
+                log_error('error encountered while processing '
+                          '{}, skipping'.format(name))
+                yield name, None
+    finally:
+        # Also when the caller stops early: drop the lookups that did not start yet
+        pool.shutdown(wait=True, cancel_futures=True)
+
 if __name__ == '__main__':
+    # Cache all pages on disk, re-runs only revalidate pages older than a day
+    http_session.configure(cache=HTTPCache('http_cache', ttl=24 * 3600))
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+    METRICS.open_jsonl('scrape_metrics.jsonl')
+
     print('Getting the list of names....')
     names = get_names()
     print('... done.\n')
 
-    results = []
+    top_k = 5
+    top_marks = []
+    no_results = 0
 
     print('Getting stats for each name....')
 
-    for name in names:
-        try:
-            hits = get_hits_on_name(name)
-            if hits is None:
-                hits = -1
-            results.append((hits, name))
-        except:
-            results.append((-1, name))
-            log_error('error encountered while processing '
-                      '{}, skipping'.format(name))
+    # Keep only the top k in a min-heap while the lookups come in
+    for name, hits in get_hits_on_names(names, workers=8, rate=10, timeout=10):
+        if hits is None:
+            hits = -1
+            no_results += 1
+        if len(top_marks) < top_k:
+            heapq.heappush(top_marks, (hits, name))
+        else:
+            heapq.heappushpop(top_marks, (hits, name))
 
     print('... done.\n')
 
-    results.sort()
-    results.reverse()
-
-    if len(results) > 5:
-        top_marks = results[:5]
-    else:
-        top_marks = results
+    top_marks.sort(reverse=True)
 
     print('\nThe most literate mathematicians are:\n')
     for (mark, mathematician) in top_marks:
         print('{} with {} results'.format(mathematician, mark))
 
-    no_results = len([res for res in results if res[0] == -1])
     print('\nBut we did not find results for '
-          '{} mathematicians on the list'.format(no_results))
\ No newline at end of file
+          '{} mathematicians on the list'.format(no_results))
+
+    # Request counts, bytes and latency quantiles of the whole run
+    METRICS.write_prometheus('scrape_metrics.prom')
\ No newline at end of file
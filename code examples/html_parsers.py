@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Pluggable HTML parser backends for the scrapers. An Extractor compiles its
+CSS selectors once for one backend: lxml (XPath), BeautifulSoup (soupsieve)
+or selectolax (lexbor, optional). All backends return the same elements and
+the same text for the selectors the scrapers use.
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import functools
+import re
+
+import lxml.html
+import soupsieve
+from bs4 import BeautifulSoup
+from lxml import etree
+
+
+#%%
+""" Settings """
+DEFAULT_BACKEND = 'lxml'
+
+#Simple selectors only: 'tag', '.class', 'tag.class' and descendants of those separated by spaces
+SIMPLE_SELECTOR = re.compile(r'^([a-zA-Z][a-zA-Z0-9]*|\*)?((?:\.[\w-]+)*)$')
+
+
+#%%
+""" Function definitions """
+
+def css_to_xpath(css):
+    """Translates a simple CSS selector to XPath, matching classes like BeautifulSoup does
+    Args:
+        css: selector such as 'li', 'h3.item-count' or 'div.user-comment span.BAscore_norm'
+
+    Returns:
+        XPath expression relative to the node it is evaluated on
+    """
+    steps = []
+    for part in css.split():
+        match = SIMPLE_SELECTOR.match(part)
+        if match is None:
+            raise ValueError("unsupported selector: " + css)
+        conditions = ['contains(concat(" ", normalize-space(@class), " "), " {} ")'.format(name)
+                      for name in match[2].split('.') if name]
+        steps.append((match[1] or '*') + ''.join('[' + condition + ']' for condition in conditions))
+    return('.//' + '//'.join(steps))
+
+
+@functools.lru_cache(maxsize = None)
+def cached_extractor(selectors, backend):
+    return(Extractor(dict(selectors), backend))
+
+
+def get_extractor(selectors, backend = DEFAULT_BACKEND):
+    """Returns the Extractor of `selectors` for `backend`, compiled only once per process"""
+    return(cached_extractor(tuple(sorted(selectors.items())), backend))
+
+
+#%%
+""" Object definitions """
+
+class LxmlBackend():
+    """lxml.html parser, selectors compiled to XPath"""
+    name = 'lxml'
+
+    def parse(self, body, encoding = None):
+        try:
+            if encoding is not None and isinstance(body, bytes):
+                return(lxml.html.fromstring(body, parser = lxml.html.HTMLParser(encoding = encoding)))
+            return(lxml.html.fromstring(body))
+        except etree.ParserError:
+            #Whitespace or comments only, the other backends return an empty document for those
+            return(lxml.html.fromstring('<html></html>'))
+
+    def compile(self, css):
+        return(etree.XPath(css_to_xpath(css)))
+
+    def select(self, selector, node):
+        return(selector(node))
+
+    def text(self, node):
+        return(node.text_content())
+
+    def html(self, node):
+        return(lxml.html.tostring(node, encoding = 'unicode', with_tail = False))
+
+
+class SoupBackend():
+    """BeautifulSoup with the pure Python html.parser, selectors compiled with soupsieve"""
+    name = 'bs4'
+
+    def parse(self, body, encoding = None):
+        if encoding is not None and isinstance(body, bytes):
+            return(BeautifulSoup(body, 'html.parser', from_encoding = encoding))
+        return(BeautifulSoup(body, 'html.parser'))
+
+    def compile(self, css):
+        return(soupsieve.compile(css))
+
+    def select(self, selector, node):
+        return(selector.select(node))
+
+    def text(self, node):
+        return(node.get_text())
+
+    def html(self, node):
+        return(str(node))
+
+
+class SelectolaxBackend():
+    """selectolax with the lexbor engine, the fastest backend if the package is installed"""
+    name = 'selectolax'
+
+    def __init__(self):
+        try:
+            from selectolax.lexbor import LexborHTMLParser
+        except ImportError:
+            raise ImportError("the selectolax backend needs the selectolax package: pip install selectolax")
+        self.parser = LexborHTMLParser
+
+    def parse(self, body, encoding = None):
+        if encoding is not None and isinstance(body, bytes):
+            body = body.decode(encoding, errors = 'replace')
+        return(self.parser(body))
+
+    def compile(self, css):
+        #selectolax has no compiled selector objects, lexbor caches the parsed selector itself
+        return(css)
+
+    def select(self, selector, node):
+        return(node.css(selector))
+
+    def text(self, node):
+        return(node.text(deep = True))
+
+    def html(self, node):
+        return(node.html)
+
+
+BACKENDS = {'lxml': LxmlBackend, 'bs4': SoupBackend, 'selectolax': SelectolaxBackend}
+
+
+class Extractor():
+    """Named CSS selectors compiled once for one parser backend
+
+    Attributes:
+        selectors (dict): Name of every selector to its CSS
+        backend (str): 'lxml', 'bs4' or 'selectolax'
+
+    """
+    def __init__(self, selectors, backend = DEFAULT_BACKEND):
+        if backend not in BACKENDS:
+            raise ValueError("unknown parser backend {}, choose from {}".format(backend, ', '.join(BACKENDS)))
+        self.backend = backend
+        self.parser = BACKENDS[backend]()
+        self.selectors = {name: self.parser.compile(css) for name, css in selectors.items()}
+
+    def parse(self, body, encoding = None):
+        """Parses a page (bytes or string) into the document of the backend
+        Args:
+            body: the page
+            encoding: encoding of a bytes body declared by the server, otherwise the
+                      backend looks at the meta tags or guesses
+        """
+        return(self.parser.parse(body, encoding))
+
+    def select(self, name, node):
+        """Returns all elements below `node` matching the selector `name`, in document order"""
+        return(self.parser.select(self.selectors[name], node))
+
+    def first(self, name, node):
+        """Returns the first element matching the selector `name`, None if there is none"""
+        nodes = self.select(name, node)
+        return(nodes[0] if nodes else None)
+
+    def text(self, node):
+        """Returns all text of an element and its descendants"""
+        return(self.parser.text(node))
+
+    def html(self, node):
+        """Returns the HTML of an element, without the text following it"""
+        return(self.parser.html(node))
+
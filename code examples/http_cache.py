@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent on-disk HTTP response cache. Bodies are stored gzip compressed
+under the hash of their content, an SQLite index maps every url to its
+body and validators. Stale entries are revalidated with conditional GETs
+(ETag / Last-Modified), old entries are evicted least recently used first
+and an offline mode replays the cache without touching the network.
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import gzip
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+import requests
+from requests.exceptions import RequestException
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from scrape_metrics import METRICS
+
+
+#%%
+""" Settings """
+#Access times of lookups are written to the index in batches of this many urls
+ACCESS_BATCH = 100
+#Entries removed per query while evicting
+EVICT_BATCH = 100
+
+
+#%%
+""" Object definitions """
+
+class CacheMiss(RequestException):
+    """Raised in offline mode when a url is not in the cache"""
+    pass
+
+
+class HTTPCache():
+    """Content-addressed response cache on local disk
+
+    Attributes:
+        directory (str): Folder holding the index and the compressed bodies
+        ttl (float): Seconds a response is used without revalidation, None to always revalidate
+        max_size (int): Maximum total size of the stored bodies in bytes, None for no limit
+        offline (bool): Only replay cached responses, never go to the network
+        revalidate (str): Optional regular expression of urls that are revalidated on every request
+                          however fresh, e.g. pages an incremental crawl looks for changes on
+
+    """
+    def __init__(self, directory, ttl = None, max_size = None, offline = False, revalidate = None):
+        self.directory = directory
+        self.ttl = ttl
+        self.revalidate = re.compile(revalidate) if revalidate is not None else None
+        self.max_size = max_size
+        self.offline = offline
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.join(directory, "objects"), exist_ok = True)
+        self.db = sqlite3.connect(os.path.join(directory, "index.sqlite"), check_same_thread = False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS entries (
+                               url TEXT PRIMARY KEY, final_url TEXT, status INTEGER, headers TEXT,
+                               etag TEXT, last_modified TEXT, digest TEXT, size INTEGER,
+                               stored REAL, accessed REAL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self.db.commit()
+
+        #Total size of the stored bodies, kept up to date by store and evict
+        self.total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM "
+                                     "(SELECT MAX(size) AS size FROM entries GROUP BY digest)").fetchone()[0]
+        #Urls looked up since the last write of the access times
+        self.accessed = {}
+
+    def object_path(self, digest):
+        """Returns the file name of the body with hash `digest`"""
+        return(os.path.join(self.directory, "objects", digest[:2], digest + ".gz"))
+
+    def lookup(self, url):
+        """Returns the index entry of `url` as a dictionary, or None if it is not cached"""
+        with self.lock:
+            cursor = self.db.execute("SELECT * FROM entries WHERE url = ?", (url,))
+            row = cursor.fetchone()
+            if row is None:
+                return(None)
+            entry = dict(zip([column[0] for column in cursor.description], row))
+            self.accessed[url] = time.time()
+            if len(self.accessed) >= ACCESS_BATCH:
+                self._write_accessed()
+        return(entry)
+
+    def _write_accessed(self):
+        """Writes the access times of the recent lookups to the index"""
+        if self.accessed:
+            self.db.executemany("UPDATE entries SET accessed = ? WHERE url = ?",
+                                [(accessed, url) for url, accessed in self.accessed.items()])
+            self.db.commit()
+            self.accessed = {}
+
+    def is_fresh(self, entry):
+        """Checks if an entry may be used without revalidation"""
+        if self.revalidate is not None and self.revalidate.search(entry['url']):
+            return(False)
+        return(self.ttl is not None and time.time() - entry['stored'] < self.ttl)
+
+    def store(self, url, resp):
+        """Stores a successful response under `url` and evicts old entries if needed"""
+        body = resp.content
+        digest = hashlib.sha256(body).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok = True)
+            #A temporary file of its own per writer, threads can store the same body at once
+            fd, temp = tempfile.mkstemp(suffix = ".tmp", dir = os.path.dirname(path))
+            try:
+                with gzip.open(os.fdopen(fd, "wb"), "wb") as f:
+                    f.write(body)
+                os.replace(temp, path)
+            except BaseException:
+                os.remove(temp)
+                raise
+        size = os.path.getsize(path)
+
+        now = time.time()
+        headers = {key: value for key, value in resp.headers.items()
+                   if key.lower() not in ('content-encoding', 'content-length', 'transfer-encoding')}
+        with self.lock:
+            old = self.db.execute("SELECT digest, size FROM entries WHERE url = ?", (url,)).fetchone()
+            if self.db.execute("SELECT 1 FROM entries WHERE digest = ?", (digest,)).fetchone() is None:
+                self.total += size
+            self.db.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                            (url, resp.url, resp.status_code, json.dumps(headers),
+                             resp.headers.get('ETag'), resp.headers.get('Last-Modified'),
+                             digest, size, now, now))
+            self.accessed.pop(url, None)
+            self.db.commit()
+            if old is not None and old[0] != digest:
+                self._drop_object(*old)
+            self._evict()
+
+    def revalidated(self, url):
+        """Marks the entry of `url` as fresh again after a 304 Not Modified"""
+        with self.lock:
+            self.db.execute("UPDATE entries SET stored = ? WHERE url = ?", (time.time(), url))
+            self.db.commit()
+
+    def _drop_object(self, digest, size):
+        """Deletes a body file once no entry refers to it anymore"""
+        if self.db.execute("SELECT 1 FROM entries WHERE digest = ?", (digest,)).fetchone() is None:
+            self.total -= size
+            try:
+                os.remove(self.object_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def _evict(self):
+        """Removes least recently used entries until the bodies fit in max_size"""
+        if self.max_size is None or self.total <= self.max_size:
+            return
+        self._write_accessed()
+        while self.total > self.max_size:
+            oldest = self.db.execute("SELECT url, digest, size FROM entries ORDER BY accessed LIMIT ?",
+                                     (EVICT_BATCH,)).fetchall()
+            if not oldest:
+                break
+            for url, digest, size in oldest:
+                self.db.execute("DELETE FROM entries WHERE url = ?", (url,))
+                self._drop_object(digest, size)
+                if self.total <= self.max_size:
+                    break
+        self.db.commit()
+
+    def response(self, entry):
+        """Rebuilds a requests response object from a cache entry"""
+        try:
+            with gzip.open(self.object_path(entry['digest']), "rb") as f:
+                body = f.read()
+        except FileNotFoundError:
+            return(None)
+        resp = requests.Response()
+        resp._content = body
+        resp._content_consumed = True
+        resp.status_code = entry['status']
+        resp.headers = CaseInsensitiveDict(json.loads(entry['headers']))
+        resp.encoding = get_encoding_from_headers(resp.headers)
+        resp.url = entry['final_url']
+        resp.from_cache = True
+        return(resp)
+
+    def close(self):
+        with self.lock:
+            self._write_accessed()
+            self.db.close()
+
+
+class CachedSession(requests.Session):
+    """requests session that answers GET requests from an HTTPCache when it can
+
+    Attributes:
+        cache: HTTPCache object
+
+    """
+    def __init__(self, cache):
+        super().__init__()
+        self.cache = cache
+
+    def get(self, url, **kwargs):
+        """Cached GET request, accepts the same keyword arguments as requests.Session.get"""
+        entry = self.cache.lookup(url)
+        if entry is not None and (self.cache.offline or self.cache.is_fresh(entry)):
+            resp = self.cache.response(entry)
+            if resp is not None:
+                METRICS.inc('http_cache_total', result = 'hit')
+                return(resp)
+        if self.cache.offline:
+            raise CacheMiss('{} is not in the cache'.format(url))
+
+        #Ask the server to only send the body if it changed since it was cached
+        request_headers = kwargs.pop('headers', None) or {}
+        headers = dict(request_headers)
+        if entry is not None:
+            if entry['etag']:
+                headers['If-None-Match'] = entry['etag']
+            if entry['last_modified']:
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        resp = super().get(url, headers = headers, **kwargs)
+        if resp.status_code == 304 and entry is not None:
+            cached = self.cache.response(entry)
+            if cached is not None:
+                resp.close()
+                self.cache.revalidated(url)
+                METRICS.inc('http_cache_total', result = 'revalidated')
+                return(cached)
+            #The body went missing, fetch it again without validators
+            resp = super().get(url, headers = request_headers, **kwargs)
+        if resp.status_code == 200:
+            self.cache.store(url, resp)
+        METRICS.inc('http_cache_total', result = 'miss')
+        return(resp)
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+Lightweight resolver for the URLScraper search flow. Runs the same
+search -> profile -> last page logic as the Selenium driver, but over plain
+HTTP with lxml XPath, so no browser has to be started per thread.
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import lxml.html
+from lxml import etree
+
+from http_session import get_session
+
+
+#%%
+""" Object definitions """
+
+class NeedsBrowser(Exception):
+    """Raised when a page can not be resolved without executing JavaScript"""
+    pass
+
+
+class HTTPResolver():
+    """Resolves a search url to the beer profile and its last page with reviews
+
+    Attributes:
+        session: requests session used to fetch the pages
+        timeout (float): Timeout in seconds for every request
+
+    """
+    # XPath expressions are compiled once and shared by all resolvers
+    profile_marker = "/beer/profile"
+    search_results = etree.XPath('//div[@id = "ba-content"]/div/div/span|//div[@id = "ba-content"]/div/div/a')
+    search_content = etree.XPath('//div[@id = "ba-content"]')
+    last_page = etree.XPath('//span/*[text() = "last"]')
+    title = etree.XPath('//h1')
+
+    def __init__(self, session = None, timeout = 10):
+        self.session = session if session is not None else get_session()
+        self.timeout = timeout
+
+    def load(self, url):
+        """Fetches a page and parses it with lxml
+        Args:
+            url: url of the page
+
+        Returns:
+            tuple of the final url (after redirects) and the parsed document
+
+        Raises:
+            requests.exceptions.HTTPError for an error status, a browser would not get further
+            than the same 404, 429 or 503, so the term fails and is retried in a later run
+        """
+        resp = self.session.get(url, timeout = self.timeout)
+        resp.raise_for_status()
+        doc = lxml.html.fromstring(resp.content, base_url = resp.url)
+        #Make the links absolute, as the browser does when reading the href property
+        doc.make_links_absolute(resp.url)
+        return(resp.url, doc)
+
+    def get_title(self, doc, url):
+        """Returns the text of the first h1 on a profile page, like WebElement.text does"""
+        headers = self.title(doc)
+        if not headers:
+            raise NeedsBrowser("no title found on {}".format(url))
+        for br in headers[0].iter('br'):
+            br.tail = '\n' + (br.tail or '')
+        lines = [line.strip() for line in headers[0].text_content().split('\n')]
+        return('\n'.join(line for line in lines if line))
+
+    def resolve(self, search_url):
+        """Runs the search logic for one search url
+        Args:
+            search_url: url of the search results for a search term
+
+        Returns:
+            None if there are no search results, otherwise a tuple of the beer found,
+            the url of the profile page and the url of the last page with reviews
+            (None if there is only one page with reviews)
+        """
+        url, doc = self.load(search_url)
+
+        if self.profile_marker not in url:
+            #If you're not directly sent to the profile page, take the top search result
+            if not self.search_content(doc):
+                raise NeedsBrowser("no search results container on {}".format(url))
+            links = [element.get('href') for element in self.search_results(doc)]
+            links = [link for link in links if link]
+            if not links:
+                return(None)
+            url, doc = self.load(links[0])
+        return(self.read_profile(url, doc))
+
+    def read_profile(self, url, doc):
+        """Returns the beer found, the url and the url of the last page with reviews of a profile page"""
+        beer_found = self.get_title(doc, url)
+        last = self.last_page(doc)
+        last_page_url = last[0].get('href') if last else None
+        return(beer_found, url, last_page_url)
+
+    def resolve_profile(self, profile_url):
+        """Reads a known profile page without searching
+        Args:
+            profile_url: url of the profile page
+
+        Returns:
+            the same tuple as resolve
+        """
+        url, doc = self.load(profile_url)
+        if self.profile_marker not in url:
+            raise NeedsBrowser("{} is no profile page anymore".format(profile_url))
+        return(self.read_profile(url, doc))
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Shared HTTP session layer. All scrapers fetch through one pooled requests
+session so TCP/TLS connections to the same host are kept alive and reused
+instead of being set up again for every single page.
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import threading
+
+import requests
+from urllib3.util.request import ACCEPT_ENCODING
+
+from http_cache import CachedSession
+from resilience import RESILIENCE, make_resilient
+from scrape_metrics import METRICS, TracingAdapter, instrument
+
+
+#%%
+""" Settings """
+# Encodings the installed urllib3 can decode, 'br' is included when brotli is installed
+DEFAULT_HEADERS = {'Accept-Encoding': ACCEPT_ENCODING,
+                   'Connection': 'keep-alive'}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+#%%
+""" Function definitions """
+
+def make_session(pool_connections = 10, pool_maxsize = 20, pool_block = False, headers = None, cache = None,
+                 resilience = RESILIENCE):
+    """Creates a requests session with connection pooling and keep-alive
+    Args:
+        pool_connections: amount of hosts to keep a connection pool for (integer)
+        pool_maxsize: maximum amount of connections kept alive per host (integer)
+        pool_block: if True, wait for a free connection instead of opening a throw-away one
+        headers: optional dictionary of extra headers sent with every request
+        cache: optional HTTPCache object GET requests are answered from and stored in
+        resilience: Resilience object retrying the GET requests, None to send every request once
+
+    Returns:
+        requests.Session object, every request is traced into scrape_metrics.METRICS
+    """
+    session = CachedSession(cache) if cache is not None else requests.Session()
+    adapter = TracingAdapter(pool_connections = pool_connections, pool_maxsize = pool_maxsize,
+                             pool_block = pool_block)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(DEFAULT_HEADERS)
+    if headers:
+        session.headers.update(headers)
+    #Every attempt is traced, the retries wrap around the tracing
+    instrument(session, METRICS)
+    if resilience is not None:
+        make_resilient(session, resilience)
+    return(session)
+
+
+def configure(**kwargs):
+    """Replaces the shared session by a new one created with make_session(**kwargs)
+    Returns:
+        the new shared session
+    """
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = make_session(**kwargs)
+    return(_session)
+
+
+def get_session():
+    """Returns the shared session, creating it with the default settings on first use"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+    return(_session)
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental recrawl of the review pages. For every beer the start of its
+last review page, the amount of stored reviews and the date of the newest
+one are kept in SQLite. A re-run only fetches the first pages, as far as the
+last page moved since the previous run, and only appends the reviews that
+are newer than what the ReviewStore already holds.
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import re
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+
+from review_store import BEER_ID_PATTERN, DATE_FORMAT
+
+
+#%%
+""" Function definitions """
+
+def beer_id(url):
+    """Returns the '<brewery>-<beer>' id of a profile url, None for anything else"""
+    match = re.search(BEER_ID_PATTERN, url) if isinstance(url, str) else None
+    return(match[1] + '-' + match[2] if match else None)
+
+
+def page_start(url):
+    """Returns the start= offset of a review page url, 0 for the first page"""
+    try:
+        return(int(parse_qs(urlsplit(url).query).get('start', ['0'])[0] or 0))
+    except (ValueError, TypeError):
+        return(0)
+
+
+#%%
+""" Object definitions """
+
+class IncrementalCrawl():
+    """Per beer crawl state deciding which review pages can hold new reviews
+
+    Reviews are listed newest first, 25 per page: if the last page moved by k pages
+    since the previous run, the new reviews all fit on the first k + 1 pages.
+
+    Attributes:
+        path (str): SQLite database file of the crawl state
+        store: ReviewStore the new reviews are merged into
+
+    """
+    def __init__(self, path, store):
+        self.path = path
+        self.store = store
+        self.lock = threading.Lock()
+        self.current = {}    # Start of the last page of every beer planned in this run, plan may run per batch
+        self.db = sqlite3.connect(path, check_same_thread = False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS beers (
+                               beer TEXT PRIMARY KEY, last_start INTEGER, reviews INTEGER,
+                               newest TEXT, updated REAL)""")
+        self.db.commit()
+
+    def state(self, beers):
+        """Returns the stored state of `beers` as a dictionary of beer to (last_start, reviews, newest)"""
+        beers = set(beers)
+        with self.lock:
+            rows = self.db.execute("SELECT beer, last_start, reviews, newest FROM beers").fetchall()
+        return({row[0]: (row[1], row[2], pd.Timestamp(row[3]) if row[3] else None) for row in rows if row[0] in beers})
+
+    def plan(self, data, urls = 'Beer_link'):
+        """Selects the review pages that can contain reviews not stored yet
+        Args:
+            data: dataframe with the output of the URL scraper
+            urls: name of the column containing the urls
+
+        Returns:
+            the rows of `data` to scrape: every page of new beers, the first pages of known ones
+        """
+        ids = data[urls].map(beer_id)
+        starts = data[urls].map(page_start)
+        current = starts.groupby(ids).max().to_dict()
+        self.current.update(current)
+        state = self.state(current)
+
+        keep = []
+        for beer, start in zip(ids, starts):
+            if beer is None or beer not in state:
+                keep.append(True)
+            else:
+                keep.append(start <= max(current[beer] - state[beer][0], 0))
+        selected = data[pd.Series(keep, index = data.index, dtype = bool)]
+        print("Review pages to fetch: " + str(len(selected)) + " of " + str(len(data)) +
+              " (" + str(len(current) - len(state)) + " new beers)")
+        return(selected)
+
+    def merge(self, output, failed = ()):
+        """Appends the reviews that are newer than the stored ones and updates the state
+        Args:
+            output: compiled reviews of the pages returned by plan
+            failed: urls that could not be retrieved, their beers are left for the next run
+
+        Returns:
+            amount of reviews appended to the store
+        """
+        ids = output['url'].map(beer_id)
+        skip = {beer_id(url) for url in failed}
+        output = output[ids.notna() & ~ids.isin(skip)]
+        ids = ids[output.index]
+        dates = pd.to_datetime(output['Date'].astype(str).str.strip(), format = DATE_FORMAT, errors = 'coerce')
+        state = self.state(set(ids))
+
+        #Reviews of known beers on the day of their newest stored review may be stored already
+        known = set()
+        if state:
+            stored = self.store.read(beers = list(state), columns = ['beer', 'Date', 'Text'])
+            for beer, date, text in zip(stored['beer'].astype(str), stored['Date'], stored['Text']):
+                if state[beer][2] is not None and date >= state[beer][2]:
+                    known.add((beer, date, text if isinstance(text, str) else "N/A"))
+
+        new = []
+        for beer, date, text in zip(ids, dates, output['Text']):
+            if beer not in state:
+                new.append(True)
+            else:
+                newest = state[beer][2]
+                new.append(not pd.isna(date) and (newest is None or date > newest or
+                                                  (date == newest and (beer, date, text) not in known)))
+        new_reviews = output[new]
+        if len(new_reviews):
+            self.store.append(new_reviews)
+
+        #Reviews are repeated for every search term of a beer, count every review once
+        added = new_reviews.assign(beer = ids[new_reviews.index]).drop_duplicates(['beer', 'Date', 'Text', 'Overall'])
+        counts = added['beer'].value_counts().to_dict()
+        newest_dates = dates[output.index].groupby(ids).max().to_dict()
+        with self.lock:
+            for beer, last_start in self.current.items():
+                if beer in skip:
+                    continue
+                last_start_old, reviews, newest = state.get(beer, (0, 0, None))
+                newest_date = newest_dates.get(beer)
+                if newest_date is not None and not pd.isna(newest_date) and (newest is None or newest_date > newest):
+                    newest = newest_date
+                self.db.execute("INSERT OR REPLACE INTO beers VALUES (?, ?, ?, ?, ?)",
+                                (beer, int(last_start), int(reviews + counts.get(beer, 0)),
+                                 newest.isoformat() if newest is not None else None, time.time()))
+            self.db.commit()
+        return(len(new_reviews))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent index of product names to beer profiles. Every name a search
+resolved is stored in SQLite under its normalized form, together with the
+profile url and the name found on the site. Later runs look a name up
+exactly or, for variants that are spelled a bit differently, by the overlap
+of their character trigrams, and only search the site for names without a
+confident match.
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import Counter
+
+
+#%%
+""" Settings """
+NGRAM = 3
+# Fuzzy matches scoring below this are searched for again
+MIN_SCORE = 0.85
+
+
+#%%
+""" Function definitions """
+
+def normalize(name):
+    """Returns the normalized form of a product name: no accents, lower case, only letters,
+    digits and single spaces, e.g. 'Grolsch  Premium Weizen ' -> 'grolsch premium weizen'"""
+    name = unicodedata.normalize('NFKD', str(name))
+    name = ''.join(char for char in name if not unicodedata.combining(char)).lower().replace(',', '.')
+    return(' '.join(re.findall(r'[a-z0-9]+(?:\.[0-9]+)?', name)))
+
+
+def ngrams(name, n = NGRAM):
+    """Returns the set of character n-grams of a normalized name, every token padded with spaces"""
+    grams = set()
+    for token in name.split():
+        token = ' ' + token + ' '
+        grams.update(token[i:i + n] for i in range(max(1, len(token) - n + 1)))
+    return(grams)
+
+
+def numbers(name):
+    """Returns the numeric tokens of a normalized name, such as alcohol percentages and sizes"""
+    return({token for token in name.split() if token[0].isdigit()})
+
+
+def profile_url(url):
+    """Returns the profile url of a profile or review page url, without the query"""
+    return(url.split('?')[0])
+
+
+#%%
+""" Object definitions """
+
+class NameIndex():
+    """SQLite backed index of product names resolved to beer profiles
+
+    Attributes:
+        path (str): SQLite database file
+        min_score (float): Lowest score of a match that is used instead of a search,
+                           exact matches score the confidence they were stored with
+        n (int): Length of the character n-grams of the fuzzy lookup
+
+    """
+    def __init__(self, path, min_score = MIN_SCORE, n = NGRAM):
+        self.path = path
+        self.min_score = min_score
+        self.n = n
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread = False)
+        self.db.execute("""CREATE TABLE IF NOT EXISTS names (
+                               name TEXT PRIMARY KEY, search TEXT, beer_found TEXT,
+                               beer_link TEXT, confidence REAL, updated REAL)""")
+        self.db.commit()
+
+        #Names and their n-grams are kept in memory, the inverted index gives the fuzzy candidates
+        self.entries = {}    # Normalized name to (beer_found, beer_link, confidence)
+        self.grams = {}      # n-gram to the set of normalized names containing it
+        for name, beer_found, beer_link, confidence in self.db.execute(
+                "SELECT name, beer_found, beer_link, confidence FROM names"):
+            self.remember(name, beer_found, beer_link, confidence)
+
+    def __len__(self):
+        return(len(self.entries))
+
+    def remember(self, name, beer_found, beer_link, confidence):
+        self.entries[name] = (beer_found, beer_link, confidence)
+        for gram in ngrams(name, self.n):
+            self.grams.setdefault(gram, set()).add(name)
+
+    def add(self, search, beer_found, beer_link, confidence = 1.0):
+        """Stores the profile a search term resolved to
+        Args:
+            search: product name that was searched for
+            beer_found: name of the beer on the profile page
+            beer_link: url of the profile page or one of its review pages
+            confidence: how sure the search is of the profile, 1.0 for a real search
+        """
+        name = normalize(search)
+        if not name:
+            return
+        beer_link = profile_url(beer_link)
+        with self.lock:
+            self.remember(name, beer_found, beer_link, confidence)
+            self.db.execute("INSERT OR REPLACE INTO names VALUES (?, ?, ?, ?, ?, ?)",
+                            (name, str(search), beer_found, beer_link, confidence, time.time()))
+            self.db.commit()
+
+    def lookup(self, search):
+        """Finds the profile of a product name
+        Args:
+            search: product name to look up
+
+        Returns:
+            None if there is no match, otherwise a tuple of the beer found, the profile url,
+            the score of the match (0 - 1) and the normalized name that matched
+        """
+        name = normalize(search)
+        with self.lock:
+            if name in self.entries:
+                beer_found, beer_link, confidence = self.entries[name]
+                return(beer_found, beer_link, confidence, name)
+
+            #Fuzzy: Dice coefficient of the n-grams, over the names sharing at least one n-gram
+            grams = ngrams(name, self.n)
+            shared = Counter(other for gram in grams for other in self.grams.get(gram, ()))
+            best = None
+            for other, count in shared.items():
+                #Variants differing in a number (0.0, 5.0, 33) are different beers
+                if numbers(other) != numbers(name):
+                    continue
+                score = 2 * count / (len(grams) + len(ngrams(other, self.n)))
+                if best is None or score > best[0]:
+                    best = (score, other)
+            if best is None:
+                return(None)
+            beer_found, beer_link, confidence = self.entries[best[1]]
+            return(beer_found, beer_link, best[0] * confidence, best[1])
+
+    def resolve(self, search):
+        """Returns the lookup of a product name if it is confident enough to skip the search, else None"""
+        match = self.lookup(search)
+        return(match if match is not None and match[2] >= self.min_score else None)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
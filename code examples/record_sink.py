@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming record sink for the scrapers. Rows are buffered as plain tuples
+and flushed in chunks to CSV or Parquet while the scrape is running, so
+memory stays flat and a crash only loses the rows of the current chunk.
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+
+#%%
+""" Object definitions """
+
+class RecordSink():
+    """Thread-safe buffer of output rows that is flushed to disk in chunks
+
+    Without a path the rows are kept in memory and only converted into a
+    dataframe once, in to_frame().
+
+    Attributes:
+        columns (list): Column names of the rows
+        path (str): Output file, a '.parquet' path is written as a directory of part files,
+                    any other path as one CSV file. None keeps the rows in memory
+        chunk_size (int): Amount of buffered rows that triggers a flush
+        sep (str): Field separator of the CSV file
+        types (dict): Arrow type name of every column that is not a string, e.g. {'Overall': 'float64'}.
+                      All Parquet parts are written with this one schema, also a chunk that only
+                      holds missing values
+
+    """
+    def __init__(self, columns, path = None, chunk_size = 500, sep = ";", types = None):
+        self.columns = list(columns)
+        types = types or {}
+        self.schema = pa.schema([(column, pa.type_for_alias(types.get(column, 'string'))) for column in self.columns])
+        self.path = path
+        self.chunk_size = chunk_size
+        self.sep = sep
+        self.parquet = path is not None and path.endswith(".parquet")
+        self.buffer = []
+        self.parts = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+        #Never append to the output of an earlier run
+        if self.parquet:
+            os.makedirs(path, exist_ok = True)
+            for name in os.listdir(path):
+                if name.startswith("part-"):
+                    os.remove(os.path.join(path, name))
+        elif path is not None and os.path.exists(path):
+            os.remove(path)
+
+    def __len__(self):
+        return(self.count)
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, row):
+        """Adds one row, given as a tuple in the order of columns or as a dictionary"""
+        self.extend([row])
+
+    def extend(self, rows):
+        """Adds many rows, given as tuples in the order of columns or as dictionaries"""
+        with self.lock:
+            for row in rows:
+                if isinstance(row, dict):
+                    row = tuple(row.get(column) for column in self.columns)
+                self.buffer.append(row)
+                self.count += 1
+            if self.path is not None and len(self.buffer) >= self.chunk_size:
+                self._flush()
+
+    def flush(self):
+        """Writes all buffered rows to disk"""
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if self.path is None or not self.buffer:
+            return
+        chunk = pd.DataFrame(self.buffer, columns = self.columns)
+        if self.parquet:
+            pq.write_table(pa.Table.from_pandas(chunk, schema = self.schema, preserve_index = False),
+                           os.path.join(self.path, "part-{:05d}.parquet".format(self.parts)))
+        else:
+            chunk.to_csv(self.path, sep = self.sep, index = False, mode = "a", header = self.parts == 0)
+        self.parts += 1
+        self.buffer = []
+
+    def close(self):
+        """Flushes the remaining rows, the sink can still be read afterwards"""
+        self.flush()
+
+    def to_frame(self):
+        """Returns all rows written so far as one dataframe"""
+        self.flush()
+        if self.path is None:
+            return(pd.DataFrame(self.buffer, columns = self.columns))
+        if self.parts == 0:
+            return(pd.DataFrame(columns = self.columns))
+        if self.parquet:
+            return(pq.read_table(self.path, schema = self.schema).to_pandas())
+        return(pd.read_csv(self.path, sep = self.sep, keep_default_na = False))
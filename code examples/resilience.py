@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+Shared resilience layer for all fetch paths. Transient errors are retried
+with exponential backoff and full jitter, Retry-After is honoured on 429 and
+503, every host gets a circuit breaker, and the pause between requests to a
+host grows while it keeps failing and shrinks again once it recovers.
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import email.utils
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.exceptions import RequestException
+
+from scrape_metrics import METRICS
+
+
+#%%
+""" Settings """
+# Statuses worth asking again, 429 and 503 usually come with a Retry-After header
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+THROTTLE_STATUSES = (429, 503)
+
+# Network errors that say nothing about the page itself
+TRANSIENT_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError)
+
+
+#%%
+""" Object definitions """
+
+class CircuitOpen(RequestException):
+    """Raised instead of sending a request to a host whose circuit breaker is open
+
+    Attributes:
+        retry_in (float): Seconds until the breaker lets a trial request through
+    """
+    def __init__(self, host, retry_in = 0.0):
+        super().__init__("circuit breaker open for " + host)
+        self.retry_in = retry_in
+
+
+def retry_after(resp):
+    """Returns the seconds a response asks to wait in its Retry-After header, None if it does not"""
+    if resp is None or 'Retry-After' not in resp.headers:
+        return(None)
+    value = resp.headers['Retry-After'].strip()
+    if value.isdigit():
+        return(float(value))
+    try:
+        return(max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time()))
+    except (TypeError, ValueError):
+        return(None)
+
+
+class HostState():
+    """Circuit breaker and adaptive pause of one host
+
+    The breaker opens after `failure_threshold` failed requests in a row and lets a single
+    trial request through once `reset_timeout` seconds have passed. The pause between
+    requests doubles on every failed attempt and shrinks by 20% on every success.
+
+    Attributes:
+        failure_threshold (int): Failures in a row that open the breaker
+        reset_timeout (float): Seconds the breaker stays open
+        min_delay (float): Pause between requests of a healthy host in seconds
+        max_delay (float): Upper limit of the pause in seconds
+
+    """
+    def __init__(self, failure_threshold = 5, reset_timeout = 30, min_delay = 0.0, max_delay = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened = None
+        self.trial = False
+        self.delay = min_delay
+        self.next_slot = 0.0
+
+    def before(self, host):
+        """Waits for the next free request slot, raises CircuitOpen while the breaker is open"""
+        with self.lock:
+            now = time.monotonic()
+            if self.opened is not None:
+                if now - self.opened < self.reset_timeout or self.trial:
+                    raise CircuitOpen(host, max(0.0, self.reset_timeout - (now - self.opened)))
+                #Half open: let one trial request through
+                self.trial = True
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.delay
+        time.sleep(max(0.0, slot - time.monotonic()))
+
+    def abort(self):
+        """Gives the trial slot back after a request that failed for reasons unrelated to the host"""
+        with self.lock:
+            self.trial = False
+
+    def success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = None
+            self.trial = False
+            #Back to the minimum once the pause is negligible
+            self.delay = self.delay * 0.8 if self.delay * 0.8 > self.min_delay + 0.01 else self.min_delay
+
+    def failure(self, wait = None, count = True):
+        """Records a failed attempt, `wait` holds all requests to the host for that many seconds
+        Args:
+            wait: seconds the host asked to wait (Retry-After)
+            count: count the attempt towards the breaker, False for the retries of one request
+                   so a single url can not open the breaker on its own
+
+        Returns:
+            True if the breaker opened
+        """
+        with self.lock:
+            if count:
+                self.failures += 1
+            self.delay = min(self.max_delay, max(self.delay * 2, 0.25))
+            if wait:
+                self.next_slot = max(self.next_slot, time.monotonic() + wait)
+            if self.trial or self.failures >= self.failure_threshold:
+                self.opened = time.monotonic()
+                self.trial = False
+                return(True)
+        return(False)
+
+
+class Resilience():
+    """Retries, backoff and circuit breakers shared by every scraper
+
+    Attributes:
+        max_attempts (int): Attempts per request, including the first one
+        backoff (float): Base of the exponential backoff in seconds
+        max_backoff (float): Upper limit of a single backoff in seconds
+        failure_threshold (int): Failures in a row after which a host's breaker opens
+        reset_timeout (float): Seconds a breaker stays open before a trial request
+        min_delay (float): Pause between requests to a healthy host in seconds
+        max_delay (float): Upper limit of the adaptive pause in seconds
+
+    """
+    def __init__(self, max_attempts = 5, backoff = 0.5, max_backoff = 60, failure_threshold = 5,
+                 reset_timeout = 30, min_delay = 0.0, max_delay = 30.0, seed = None):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.host_settings = {'failure_threshold': failure_threshold, 'reset_timeout': reset_timeout,
+                              'min_delay': min_delay, 'max_delay': max_delay}
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.hosts = {}
+
+    def host(self, url):
+        """Returns the HostState of the host of `url`"""
+        host = urlsplit(url).netloc
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = HostState(**self.host_settings)
+            return(self.hosts[host])
+
+    def backoff_time(self, attempt, resp = None):
+        """Seconds to wait before retry number `attempt` (0 based), at least what Retry-After asks"""
+        jitter = self.random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        wait = retry_after(resp) if resp is not None and resp.status_code in THROTTLE_STATUSES else None
+        return(max(jitter, min(wait, self.max_backoff)) if wait is not None else jitter)
+
+    def call(self, url, attempt, retry_on = TRANSIENT_ERRORS, stage = 'http'):
+        """Runs `attempt` until it succeeds, retrying transient failures with backoff
+        Args:
+            url: url being fetched, selects the circuit breaker and pause
+            attempt: function without arguments doing one try, may return a requests response
+            retry_on: exceptions that count as transient
+            stage: label of the retries_total metric, e.g. 'http' or 'browser'
+
+        Returns:
+            the result of the last attempt, a response with a retryable status once all attempts failed
+        """
+        host = urlsplit(url).netloc
+        state = self.host(url)
+        for n in range(self.max_attempts):
+            state.before(host)
+            resp = None
+            try:
+                result = attempt()
+            except retry_on as e:
+                #Only the first failed attempt of a request counts towards the breaker
+                if state.failure(count = n == 0):
+                    METRICS.inc('circuit_open_total', host = host)
+                if n + 1 == self.max_attempts:
+                    raise
+                METRICS.event('retry', url = url, attempt = n + 1, error = repr(e))
+            except Exception:
+                #Not transient and says nothing about the host, only give the trial slot back
+                state.abort()
+                raise
+            else:
+                if not isinstance(result, requests.Response) or result.status_code not in RETRY_STATUSES:
+                    state.success()
+                    return(result)
+                resp = result
+                if state.failure(retry_after(resp) if resp.status_code in THROTTLE_STATUSES else None, count = n == 0):
+                    METRICS.inc('circuit_open_total', host = host)
+                if n + 1 == self.max_attempts:
+                    return(resp)
+                METRICS.event('retry', url = url, attempt = n + 1, status = resp.status_code)
+                resp.close()
+            METRICS.inc('retries_total', stage = stage, host = host)
+            METRICS.set('host_delay_seconds', state.delay, host = host)
+            time.sleep(self.backoff_time(n, resp))
+
+
+def make_resilient(session, resilience):
+    """Runs every GET and HEAD request of a session through `resilience`
+    Returns:
+        the same session
+    """
+    request = session.request
+
+    def resilient_request(method, url, **kwargs):
+        if method.upper() not in ('GET', 'HEAD'):
+            return(request(method, url, **kwargs))
+        return(resilience.call(url, lambda: request(method, url, **kwargs)))
+
+    session.request = resilient_request
+    return(session)
+
+
+# Shared by all sessions and browser drivers, so every thread sees the same host state
+RESILIENCE = Resilience()
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Review parsing for the ReviewScraper, with lxml or any other backend of
+html_parsers. The functions in this module are kept at module level so they
+can run in a process pool: they take the raw bytes of a page and only pass
+plain review records back.
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import re
+import time
+from collections import namedtuple
+
+from html_parsers import DEFAULT_BACKEND, get_extractor
+
+
+#%%
+""" Settings """
+REVIEW_COLUMNS = ['Overall', 'Rdev', 'Text', 'Look', 'Feel', 'Smell', 'Taste', 'Date', 'url']
+#Arrow types of the numeric fields of a record, the others are strings
+REVIEW_TYPES = {'Overall': 'float64', 'Rdev': 'float64', 'Look': 'float64', 'Feel': 'float64',
+                'Smell': 'float64', 'Taste': 'float64'}
+
+#Compact record of one review, a tuple without per instance dictionary
+Review = namedtuple('Review', REVIEW_COLUMNS)
+
+#All score fields of a review in one pattern: every field is an optional lookahead from the start
+#of the text, so each one finds its first occurrence just like a separate re.search would
+REVIEW_PATTERN = re.compile(r'^(?=(?:[\s\S]*?overall: \d+(?P<Text>.*?)character)?)'
+                            r'(?=(?:[\s\S]*?look: (?P<Look>\d+\.?\d?))?)'
+                            r'(?=(?:[\s\S]*?feel: (?P<Feel>\d+\.?\d?))?)'
+                            r'(?=(?:[\s\S]*?smell: (?P<Smell>\d+\.?\d?))?)'
+                            r'(?=(?:[\s\S]*?taste: (?P<Taste>\d+\.?\d?))?)')
+
+#Elements of a review page, compiled once per parser backend and process
+REVIEW_SELECTORS = {'reviews': 'div.user-comment', 'overall': 'span.BAscore_norm', 'rdev': 'span.rAvg_norm'}
+
+
+#%%
+""" Function definitions """
+
+def to_float(text):
+    """Converts a score such as '4.25' or '+3.2%' to a float, None if that is not possible"""
+    if text is None:
+        return(None)
+    try:
+        return(float(text.strip().rstrip('%')))
+    except ValueError:
+        return(None)
+
+
+def failed_record(url):
+    """Returns the record of a page that could not be retrieved"""
+    return((None, None, "N/A", None, None, None, None, None, url))
+
+
+def review_record(review, url, extractor = None):
+    """Extracts one review record from a user-comment element
+    Args:
+        review: element of the review
+        url: url of the page the review was found on
+        extractor: Extractor of REVIEW_SELECTORS the element was parsed with, defaults to lxml
+
+    Returns:
+        tuple in the order of REVIEW_COLUMNS
+    """
+    extractor = extractor if extractor is not None else get_extractor(REVIEW_SELECTORS)
+    text = extractor.text(review)
+    fields = REVIEW_PATTERN.search(text)
+    overall = extractor.first('overall', review)
+    rdev = extractor.first('rdev', review)
+    return((to_float(extractor.text(overall)) if overall is not None else None,
+            to_float(extractor.text(rdev)) if rdev is not None else None,
+            fields.group('Text') if fields.group('Text') is not None else "N/A",
+            to_float(fields.group('Look')),
+            to_float(fields.group('Feel')),
+            to_float(fields.group('Smell')),
+            to_float(fields.group('Taste')),
+            ','.join(text.split(",")[-2:]),
+            url))
+
+
+def parse_reviews(url, body, keep_html = False, backend = DEFAULT_BACKEND):
+    """Parses a review page into review records
+    Args:
+        url: url of the page
+        body: raw bytes (or string) of the page
+        keep_html: also return the HTML of every review, e.g. to store it in a crawl journal
+        backend: parser backend, 'lxml', 'bs4' or 'selectolax'
+
+    Returns:
+        tuple of the list of records and the list of review HTML strings (None if not kept)
+    """
+    if not body or not body.strip():
+        return([], [] if keep_html else None)
+    extractor = get_extractor(REVIEW_SELECTORS, backend)
+    reviews = extractor.select('reviews', extractor.parse(body))
+    records = [review_record(review, url, extractor) for review in reviews]
+    html = [extractor.html(review) for review in reviews] if keep_html else None
+    return(records, html)
+
+
+def timed_parse_reviews(url, body, keep_html = False, backend = DEFAULT_BACKEND):
+    """parse_reviews that also returns its own duration, measured inside the parser process
+    Returns:
+        tuple of the records, the review HTML strings and the parse time in seconds
+    """
+    start = time.perf_counter()
+    records, html = parse_reviews(url, body, keep_html, backend)
+    return(records, html, time.perf_counter() - start)
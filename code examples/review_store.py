@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""
+Typed columnar storage of the compiled reviews. Scores are stored as
+float32 with nulls, review dates as timestamps and the repeated names and
+links dictionary encoded, in zstd compressed Parquet files partitioned by
+beer. Every append adds new part files, so runs can add to one dataset.
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import uuid
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+
+#%%
+""" Settings """
+SCORE_COLUMNS = ['Overall', 'Rdev', 'Look', 'Feel', 'Smell', 'Taste']
+CATEGORY_COLUMNS = ['Beer_search', 'Beer_found', 'Beer_link', 'url']
+PARTITION_COLUMN = 'beer'
+
+#Beer ids as they appear in the profile urls, e.g. /beer/profile/1199/76421/
+BEER_ID_PATTERN = r'/beer/profile/(\d+)/(\d+)'
+DATE_FORMAT = '%b %d, %Y'
+
+#One index width for the dictionary columns of every part file, pandas picks int8 or int16 per
+#append depending on the amount of categories and the dataset can not read those mixed
+DICTIONARY = pa.dictionary(pa.int32(), pa.string())
+
+
+#%%
+""" Object definitions """
+
+class ReviewStore():
+    """Partitioned Parquet dataset of reviews
+
+    Attributes:
+        path (str): Directory of the dataset, one beer=<brewery>-<beer> subdirectory per beer
+        compression (str): Parquet compression codec
+
+    """
+    def __init__(self, path, compression = 'zstd'):
+        self.path = path
+        self.compression = compression
+
+    def to_table(self, frame):
+        """Converts compiled reviews (all strings or already typed) to a typed Arrow table
+        Args:
+            frame: dataframe with the REVIEW_COLUMNS and optionally the URL scraper columns
+
+        Returns:
+            pyarrow Table
+        """
+        frame = frame.copy()
+        for column in SCORE_COLUMNS:
+            if column in frame.columns:
+                values = frame[column]
+                if not pd.api.types.is_numeric_dtype(values):
+                    #Strings such as '+3.2%', object or string dtype
+                    values = values.astype(str).str.rstrip('%')
+                frame[column] = pd.to_numeric(values, errors = 'coerce').astype('float32')
+        if 'Text' in frame.columns:
+            frame['Text'] = frame['Text'].where(frame['Text'] != "N/A")
+        if 'Date' in frame.columns and not pd.api.types.is_datetime64_any_dtype(frame['Date']):
+            frame['Date'] = pd.to_datetime(frame['Date'].astype(str).str.strip(), format = DATE_FORMAT, errors = 'coerce')
+        if 'Beer_link_N' in frame.columns:
+            frame['Beer_link_N'] = pd.to_numeric(frame['Beer_link_N'], errors = 'coerce').astype('Int32')
+        for column in CATEGORY_COLUMNS:
+            if column in frame.columns:
+                frame[column] = frame[column].astype('category')
+
+        ids = frame['url'].astype(str).str.extract(BEER_ID_PATTERN)
+        frame[PARTITION_COLUMN] = (ids[0] + '-' + ids[1]).fillna('unknown')
+        table = pa.Table.from_pandas(frame, preserve_index = False)
+        return(table.cast(self.fixed_schema(table.schema)))
+
+    def append(self, frame):
+        """Adds reviews to the dataset as new part files
+        Returns:
+            amount of reviews written
+        """
+        table = self.to_table(frame)
+        ds.write_dataset(table, self.path, format = 'parquet', partitioning = [PARTITION_COLUMN],
+                         partitioning_flavor = 'hive', existing_data_behavior = 'overwrite_or_ignore',
+                         basename_template = 'part-' + uuid.uuid4().hex + '-{i}.parquet',
+                         file_options = ds.ParquetFileFormat().make_write_options(compression = self.compression))
+        return(table.num_rows)
+
+    def fixed_schema(self, schema):
+        """Returns `schema` with every dictionary column as a dictionary with int32 indices"""
+        for i, field in enumerate(schema):
+            if pa.types.is_dictionary(field.type):
+                schema = schema.set(i, field.with_type(DICTIONARY))
+        return(schema)
+
+    def dataset(self):
+        dataset = ds.dataset(self.path, format = 'parquet',
+                             partitioning = ds.HivePartitioning.discover(infer_dictionary = True))
+        #Part files written with int8 or int16 indices are read with the same int32 indices
+        return(ds.dataset(self.path, format = 'parquet', schema = self.fixed_schema(dataset.schema),
+                          partitioning = dataset.partitioning))
+
+    def read(self, beers = None, columns = None):
+        """Reads the dataset, only the partitions of `beers` if given
+        Args:
+            beers: optional list of beer ids ('<brewery>-<beer>') to read
+            columns: optional list of columns to read
+
+        Returns:
+            dataframe with float32 scores, timestamps and categorical names
+        """
+        dataset = self.dataset()
+        filter = ds.field(PARTITION_COLUMN).isin(beers) if beers is not None else None
+        return(dataset.to_table(columns = columns, filter = filter).to_pandas())
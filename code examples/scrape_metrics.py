@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Metrics and tracing for the scrapers. Keeps counters, gauges and timing
+spans in memory and exports them as Prometheus text (file or HTTP endpoint)
+or as a JSON-lines event log. Requests made through the shared session are
+traced per phase: connect, time to first byte, download and parse.
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+
+#%%
+""" Object definitions """
+
+def label_key(labels):
+    return(tuple(sorted((key, str(value)) for key, value in labels.items())))
+
+
+class Metrics():
+    """Thread-safe registry of counters, gauges and spans
+
+    Attributes:
+        jsonl_path (str): Optional JSON-lines file every span and event is appended to
+        max_samples (int): Amount of most recent samples kept per span for the quantiles
+
+    """
+    def __init__(self, jsonl_path = None, max_samples = 10000):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.spans = {}
+        self.max_samples = max_samples
+        self.started = time.time()
+        self.jsonl = None
+        self.server = None
+        if jsonl_path is not None:
+            self.open_jsonl(jsonl_path)
+
+    def open_jsonl(self, path):
+        """Starts appending every span and event to a JSON-lines file"""
+        with self.lock:
+            self.jsonl = open(path, 'a', encoding = 'utf-8')
+
+    def event(self, name, **fields):
+        """Writes one event to the JSON-lines file, if one is open"""
+        if self.jsonl is None:
+            return
+        line = json.dumps(dict({'time': round(time.time(), 6), 'event': name}, **fields), default = str)
+        with self.lock:
+            self.jsonl.write(line + '\n')
+            self.jsonl.flush()
+
+    def inc(self, name, value = 1, **labels):
+        """Increases a counter"""
+        key = (name, label_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """Sets a gauge"""
+        with self.lock:
+            self.gauges[(name, label_key(labels))] = value
+
+    def observe(self, name, seconds, **labels):
+        """Records the duration of one span"""
+        key = (name, label_key(labels))
+        with self.lock:
+            samples = self.spans.setdefault(key, [0, 0.0, []])
+            samples[0] += 1
+            samples[1] += seconds
+            samples[2].append(seconds)
+            if len(samples[2]) > self.max_samples:
+                del samples[2][:len(samples[2]) - self.max_samples]
+
+    @contextmanager
+    def span(self, name, **labels):
+        """Context manager timing the code inside it as span `name`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe(name, seconds, **labels)
+            self.event(name, seconds = round(seconds, 6), **labels)
+
+    def rate(self, name):
+        """Returns the average per second of a counter (summed over its labels) since the start"""
+        with self.lock:
+            total = sum(value for (counter, labels), value in self.counters.items() if counter == name)
+        return(total / max(time.time() - self.started, 1e-9))
+
+    def to_prometheus(self):
+        """Returns all metrics in the Prometheus text exposition format"""
+        def fmt(name, labels, value):
+            text = ','.join('{}="{}"'.format(key, str(val).replace('"', '\\"')) for key, val in labels)
+            return('{}{} {}'.format(name, '{' + text + '}' if text else '', value))
+
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append('# TYPE {} {}'.format(name, kind))
+
+        with self.lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                declare(name, 'counter')
+                lines.append(fmt(name, labels, value))
+            for (name, labels), value in sorted(self.gauges.items()):
+                declare(name, 'gauge')
+                lines.append(fmt(name, labels, value))
+            for (name, labels), (count, total, samples) in sorted(self.spans.items()):
+                declare(name + '_seconds', 'summary')
+                ordered = sorted(samples)
+                for q in (0.5, 0.9, 0.99):
+                    quantile = ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0
+                    lines.append(fmt(name + '_seconds', labels + (('quantile', q),), round(quantile, 6)))
+                lines.append(fmt(name + '_seconds_sum', labels, round(total, 6)))
+                lines.append(fmt(name + '_seconds_count', labels, count))
+        return('\n'.join(lines) + '\n')
+
+    def write_prometheus(self, path):
+        """Writes the Prometheus text to a file, e.g. for the node exporter textfile collector"""
+        with open(path + '.tmp', 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(path + '.tmp', path)
+
+    def serve(self, port = 9108, host = '127.0.0.1'):
+        """Serves the metrics on http://host:port/metrics in a background thread"""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                body = metrics.to_prometheus().encode('utf-8')
+                self.send_response(200 if self.path.startswith('/metrics') else 404)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+        return(self.server)
+
+    def close(self):
+        with self.lock:
+            if self.jsonl is not None:
+                self.jsonl.close()
+                self.jsonl = None
+        if self.server is not None:
+            self.server.shutdown()
+            self.server = None
+
+
+#%%
+""" Request tracing """
+
+# Connect time of the request running on this thread, filled in by the timed connections
+_trace = threading.local()
+
+
+class TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _trace.connect = getattr(_trace, 'connect', 0.0) + time.perf_counter() - start
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _trace.connect = getattr(_trace, 'connect', 0.0) + time.perf_counter() - start
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TracingAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections record how long setting them up takes (DNS, TCP and TLS)"""
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool,
+                                                   'https': TimedHTTPSConnectionPool}
+
+
+def instrument(session, metrics):
+    """Traces every request of a session into `metrics`
+
+    Records the spans http_connect (only when a new connection was opened), http_ttfb
+    and http_download, and the counters http_responses_total (by status), http_errors_total
+    and http_bytes_total.
+    Args:
+        session: requests session, mounted with a TracingAdapter for the connect times
+        metrics: Metrics object
+
+    Returns:
+        the same session
+    """
+    request = session.request
+
+    def traced_request(method, url, **kwargs):
+        host = urlsplit(url).netloc
+        _trace.connect = 0.0
+        start = time.perf_counter()
+        try:
+            resp = request(method, url, **kwargs)
+        except Exception as e:
+            metrics.inc('http_errors_total', host = host, error = type(e).__name__)
+            metrics.event('http_error', url = url, error = repr(e))
+            raise
+        total = time.perf_counter() - start
+        ttfb = resp.elapsed.total_seconds()
+        download = max(total - ttfb, 0.0) if not kwargs.get('stream') else 0.0
+        size = len(resp.content) if not kwargs.get('stream') else int(resp.headers.get('Content-Length', 0) or 0)
+
+        if _trace.connect:
+            metrics.observe('http_connect', _trace.connect, host = host)
+        metrics.observe('http_ttfb', ttfb, host = host)
+        metrics.observe('http_download', download, host = host)
+        metrics.inc('http_responses_total', host = host, status = resp.status_code)
+        metrics.inc('http_bytes_total', size, host = host)
+        metrics.event('http_request', url = url, status = resp.status_code, bytes = size,
+                      connect = round(_trace.connect, 6), ttfb = round(ttfb, 6), download = round(download, 6))
+        return(resp)
+
+    session.request = traced_request
+    return(session)
+
+
+# Registry shared by all scrapers
+METRICS = Metrics()
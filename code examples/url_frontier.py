@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+URL frontier for the review pipeline. Urls are canonicalized (scheme and
+host case, default ports, fragments, tracking parameters, query order) and
+deduplicated with a set, or with a Bloom filter when a run is too large to
+keep every url in memory.
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import hashlib
+import math
+import threading
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+#%%
+""" Settings """
+TRACKING_PARAMS = {'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid', '_ga', '_gl'}
+TRACKING_PREFIXES = ('utm_',)
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+#%%
+""" Function definitions """
+
+def canonicalize(url):
+    """Returns the canonical form of a url, strings that are not http(s) urls are returned as they are
+    Args:
+        url: url string, e.g. a Beer_link
+
+    Returns:
+        url with a lower case scheme and host, without default port, fragment and tracking
+        parameters, and with the query parameters sorted
+    """
+    if not isinstance(url, str):
+        return(url)
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.netloc:
+        return(url)
+    host = (parts.hostname or '').lower()
+    if parts.port is not None and parts.port != DEFAULT_PORTS[scheme]:
+        host += ':' + str(parts.port)
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values = True)
+             if key.lower() not in TRACKING_PARAMS and not key.lower().startswith(TRACKING_PREFIXES)]
+    return(urlunsplit((scheme, host, parts.path or '/', urlencode(sorted(query)), '')))
+
+
+#%%
+""" Object definitions """
+
+class BloomFilter():
+    """Fixed size probabilistic set: never misses an added item, wrongly reports
+    an item as present with a probability of about `error_rate`
+
+    Attributes:
+        capacity (int): Amount of items the filter is sized for
+        error_rate (float): False positive rate at full capacity
+
+    """
+    def __init__(self, capacity, error_rate = 0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray(self.size // 8 + 1)
+
+    def positions(self, item):
+        #Double hashing: k positions from the two halves of one digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size = 16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return([(h1 + k * h2) % self.size for k in range(self.hashes)])
+
+    def add(self, item):
+        """Adds an item, returns True if it was not in the filter yet"""
+        new = False
+        for position in self.positions(item):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                new = True
+        return(new)
+
+    def __contains__(self, item):
+        return(all(self.bits[position // 8] & (1 << position % 8) for position in self.positions(item)))
+
+
+class URLFrontier():
+    """Set of the canonical urls seen so far
+
+    Attributes:
+        capacity (int): If given, urls are tracked in a Bloom filter sized for this many urls
+                        instead of an exact set (a false positive skips a url that was not seen)
+        error_rate (float): False positive rate of the Bloom filter
+
+    """
+    def __init__(self, capacity = None, error_rate = 0.001):
+        self.seen = BloomFilter(capacity, error_rate) if capacity else set()
+        self.lock = threading.Lock()
+        self.duplicates = 0
+
+    def add(self, url):
+        """Adds a url, returns True if its canonical form was not seen before"""
+        key = canonicalize(url)
+        with self.lock:
+            if isinstance(self.seen, set):
+                new = key not in self.seen
+                self.seen.add(key)
+            else:
+                new = self.seen.add(str(key))
+            if not new:
+                self.duplicates += 1
+        return(new)
+
+    def __contains__(self, url):
+        key = canonicalize(url)
+        return((key if isinstance(self.seen, set) else str(key)) in self.seen)
+
+    def dedupe(self, urls):
+        """Returns the first url of every canonical url in `urls` that was not seen before, in order"""
+        return([url for url in urls if self.add(url)])
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Shared work queue for running one crawl stage on several processes or
+machines. It is a CrawlJournal whose tasks are claimed in batches under a
+lease: a process keeps its leases alive with heartbeats, the leases of a
+process that stopped expire and are taken over by the others, and the output
+of every task is stored once, so each process can merge the complete result.
+"""
+
+#%%
+""" Loading Required libraries & packages """
+import os
+import socket
+import threading
+import time
+import uuid
+
+from crawl_journal import CrawlJournal, DONE, FAILED, PENDING
+from scrape_metrics import METRICS
+
+
+#%%
+""" Object definitions """
+
+class WorkQueue(CrawlJournal):
+    """CrawlJournal shared by several processes, tasks are handed out in leased batches
+
+    Every process opens the same SQLite file, on one machine or on a shared drive that
+    supports file locking, and can be used as the journal of a scraper.
+
+    Attributes:
+        path (str): SQLite database file shared by all processes
+        stage (str): Name of the crawl stage, e.g. 'urls' or 'reviews'
+        max_attempts (int): Failed tasks are handed out again until they failed this many times
+        lease_time (float): Seconds a claimed task stays reserved without a heartbeat
+        batch_size (int): Amount of tasks claimed at once
+        worker (str): Name of this process in the leases, defaults to host, pid and a random suffix
+
+    """
+    def __init__(self, path, stage, max_attempts = 3, lease_time = 60, batch_size = 10, worker = None):
+        super().__init__(path, stage, max_attempts)
+        self.lease_time = lease_time
+        self.batch_size = batch_size
+        self.worker = worker or "{}-{}-{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:6])
+        self.beating = None
+        with self.lock:
+            #Other processes hold the write lock for short moments, wait for them instead of failing
+            self.db.execute("PRAGMA busy_timeout = 30000")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS leases (
+                                   stage TEXT, key TEXT, worker TEXT, expires REAL,
+                                   PRIMARY KEY (stage, key))""")
+            self.db.execute("CREATE TABLE IF NOT EXISTS markers (stage TEXT, name TEXT, worker TEXT, "
+                            "PRIMARY KEY (stage, name))")
+            self.db.commit()
+
+    def claim(self, n = None, wait = False, poll = 5):
+        """Leases the next open tasks, taking over the leases that expired
+        Args:
+            n: maximum amount of tasks, defaults to batch_size
+            wait: if no task is free while other processes still hold leases, wait until one
+                  frees up or every task is finished
+            poll: seconds between two attempts while waiting
+
+        Returns:
+            list of keys, empty once no task is left
+        """
+        while True:
+            now = time.time()
+            with self.lock:
+                #BEGIN IMMEDIATE takes the write lock, so two processes never claim the same task
+                self.db.execute("BEGIN IMMEDIATE")
+                try:
+                    reclaimed = self.db.execute("DELETE FROM leases WHERE stage = ? AND expires < ?",
+                                                (self.stage, now)).rowcount
+                    keys = [row[0] for row in self.db.execute(
+                        "SELECT key FROM tasks WHERE stage = ? AND (status = ? OR (status = ? AND attempts < ?)) "
+                        "AND key NOT IN (SELECT key FROM leases WHERE stage = ?) ORDER BY rowid LIMIT ?",
+                        (self.stage, PENDING, FAILED, self.max_attempts, self.stage, n or self.batch_size))]
+                    self.db.executemany("INSERT INTO leases VALUES (?, ?, ?, ?)",
+                                        [(self.stage, key, self.worker, now + self.lease_time) for key in keys])
+                    self.db.commit()
+                except BaseException:
+                    self.db.rollback()
+                    raise
+            if reclaimed:
+                METRICS.inc('leases_reclaimed_total', reclaimed, stage = self.stage)
+            if keys or not wait or not self.open():
+                METRICS.inc('leases_claimed_total', len(keys), stage = self.stage)
+                return(keys)
+            time.sleep(poll)
+
+    def tasks(self, poll = 5):
+        """Generator of the keys of this process, claimed batch by batch until no task is left"""
+        while True:
+            keys = self.claim(wait = True, poll = poll)
+            if not keys:
+                return
+            yield from keys
+
+    def open(self):
+        """Returns the amount of tasks that are not done and can still be tried, leased or not"""
+        with self.lock:
+            return(self.db.execute("SELECT COUNT(*) FROM tasks WHERE stage = ? AND (status = ? OR (status = ? AND attempts < ?))",
+                                   (self.stage, PENDING, FAILED, self.max_attempts)).fetchone()[0])
+
+    def heartbeat(self):
+        """Extends all leases of this process"""
+        with self.lock:
+            self.db.execute("UPDATE leases SET expires = ? WHERE stage = ? AND worker = ?",
+                            (time.time() + self.lease_time, self.stage, self.worker))
+            self.db.commit()
+
+    def start(self):
+        """Starts a thread sending a heartbeat three times per lease_time"""
+        if self.beating is not None:
+            return
+        self.beating = threading.Event()
+
+        def beat(stop):
+            while not stop.wait(self.lease_time / 3):
+                self.heartbeat()
+
+        threading.Thread(name = 'Heartbeat', target = beat, args = [self.beating], daemon = True).start()
+
+    def stop(self):
+        """Stops the heartbeat and gives the leases of tasks this process did not finish back"""
+        if self.beating is not None:
+            self.beating.set()
+            self.beating = None
+        self.release()
+
+    def release(self, key = None):
+        """Removes the lease of one task, or all leases of this process"""
+        with self.lock:
+            if key is None:
+                self.db.execute("DELETE FROM leases WHERE stage = ? AND worker = ?", (self.stage, self.worker))
+            else:
+                self.db.execute("DELETE FROM leases WHERE stage = ? AND key = ?", (self.stage, str(key)))
+            self.db.commit()
+
+    def done(self, key, output):
+        """Marks a task as done, a task finished by two processes keeps one output"""
+        super().done(key, output)
+        self.release(key)
+
+    def failed(self, key, error):
+        with self.lock:
+            #A task another process finished in the meantime stays done
+            status = self.db.execute("SELECT status FROM tasks WHERE stage = ? AND key = ?",
+                                     (self.stage, str(key))).fetchone()
+        if status is None or status[0] != DONE:
+            super().failed(key, error)
+        self.release(key)
+
+    def once(self, name):
+        """Returns True for exactly one of the processes asking, e.g. to let one of them store the merged output"""
+        with self.lock:
+            added = self.db.execute("INSERT OR IGNORE INTO markers VALUES (?, ?, ?)",
+                                    (self.stage, name, self.worker)).rowcount
+            self.db.commit()
+        return(added == 1)